@@ -0,0 +1,130 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from app.api.inference import _resolve_model, _split_cases, _split_length_prefixed, admit_request
+from app.api.models import verify_admin_token
+from app.core.config import EMBEDDING_ANN_MIN_VECTORS
+from app.core.embeddings import embedding_store
+from app.core.executor import executor
+from app.core.predictor import predict_embeddings
+from app.core.registry import ModelEntry
+
+router = APIRouter()
+
+async def _embed(entry: ModelEntry, image_buffers: List[Union[bytes, memoryview]]):
+    try:
+        logits, embeddings = await predict_embeddings(entry, image_buffers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return entry.model.decode_predictions(logits), embeddings.numpy()
+
+async def _framed_images(request: Request) -> List[memoryview]:
+    body = await request.body()
+    try:
+        image_buffers = _split_length_prefixed(body)
+        if not image_buffers:
+            raise ValueError("Empty binary body.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid binary body: {e}")
+    return image_buffers
+
+@router.post("", dependencies=[Depends(admit_request)])
+async def embed_images(request: Request, model_version: Optional[str] = Query(None)):
+    """
+    Same length-prefixed body as /inference/predict/binary. Returns the predictions and, per image, the
+    penultimate-layer embedding (pooled backbone features) computed in the same batched forward pass.
+    """
+    image_buffers = await _framed_images(request)
+    entry = _resolve_model(model_version)
+    predictions, embeddings = await _embed(entry, image_buffers)
+    return {
+        "predictions": predictions,
+        "embeddings": embeddings.tolist(),
+        "dim": embeddings.shape[1],
+        "model_version": entry.version,
+    }
+
+@router.post("/cases", dependencies=[Depends(admit_request)])
+async def store_cases(request: Request, model_version: Optional[str] = Query(None)):
+    """
+    Case-keyed body as in /inference/cases. Embeds every image and stores them under their case id for
+    similar-case search, replacing embeddings stored earlier for the same case. Returns
+    {"cases": {case_id: {"status": "ok", "predictions", "images"} | {"status": "error", "error"}}, "model_version"}.
+    """
+    body = await request.body()
+    try:
+        cases = _split_cases(body)
+        if not cases:
+            raise ValueError("Empty binary body.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid binary body: {e}")
+
+    entry = _resolve_model(model_version)
+    index = await executor.run(embedding_store.get, entry.version) # the first use of a version loads its files
+
+    async def store_case(case_id: str, image_buffers: List[memoryview]) -> Tuple[str, Dict[str, Any]]:
+        try:
+            logits, embeddings = await predict_embeddings(entry, image_buffers)
+            await executor.run(index.add, case_id, embeddings.numpy())
+        except ValueError as e:
+            # A bad image only fails its own case
+            return case_id, {"status": "error", "error": str(e)}
+        return case_id, {"status": "ok", "predictions": entry.model.decode_predictions(logits), "images": len(embeddings)}
+
+    # Cases are embedded concurrently so their images share forward passes in the batcher
+    try:
+        results = await asyncio.gather(*[store_case(case_id, image_buffers) for case_id, image_buffers in cases])
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return {"cases": dict(results), "model_version": entry.version}
+
+@router.post("/search", dependencies=[Depends(admit_request)])
+async def search_similar(
+    request: Request,
+    model_version: Optional[str] = Query(None),
+    k: int = Query(10, ge=1, le=100),
+    exclude_case_id: Optional[str] = Query(None),
+    exact: bool = Query(False)
+):
+    """
+    Same length-prefixed body as /inference/predict/binary, holding the images of one lesion. Returns its
+    predictions and the k stored cases most similar to it, best first: [{"case_id", "score" (cosine similarity
+    of the closest image pair), "image_index", "query_index"}]. Stores with EMBEDDING_ANN_MIN_VECTORS images or
+    more are searched through the approximate IVF index unless exact=true.
+    """
+    image_buffers = await _framed_images(request)
+    entry = _resolve_model(model_version)
+    predictions, embeddings = await _embed(entry, image_buffers)
+    index = await executor.run(embedding_store.get, entry.version)
+    neighbors = await executor.run(index.search, embeddings, k, exclude_case_id, exact)
+    return {
+        "predictions": predictions,
+        "neighbors": neighbors,
+        "method": "exact" if exact or index.images < EMBEDDING_ANN_MIN_VECTORS else "ivf",
+        "model_version": entry.version,
+    }
+
+@router.delete("/cases/{case_id}", dependencies=[Depends(verify_admin_token)])
+async def delete_case(case_id: str, model_version: Optional[str] = Query(None)):
+    entry = _resolve_model(model_version)
+    index = await executor.run(embedding_store.get, entry.version)
+    if not await executor.run(index.remove, case_id):
+        raise HTTPException(status_code=404, detail=f"Case '{case_id}' has no stored embeddings.")
+    return {"case_id": case_id, "status": "deleted"}
+
+@router.post("/index", dependencies=[Depends(verify_admin_token)])
+async def build_index(model_version: Optional[str] = Query(None)):
+    """Retrain the IVF index now instead of on the next search that finds it stale"""
+    entry = _resolve_model(model_version)
+    index = await executor.run(embedding_store.get, entry.version)
+    if index.images == 0:
+        raise HTTPException(status_code=404, detail=f"No embeddings stored for model version '{entry.version}'.")
+    await executor.run(index.build_ivf)
+    return index.stats()
+
+@router.get("/stats")
+def embedding_stats():
+    return embedding_store.stats()
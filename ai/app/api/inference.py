@@ -1,20 +1,110 @@
 import base64
-from fastapi import APIRouter, HTTPException, Request
-from io import BytesIO
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import StreamingResponse
+import json
 import os
-from PIL import Image
-from torch.utils.data import DataLoader
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from app.core import model
-from app.core.config import MODEL, MODEL_PATH
-from app.core.dataloader import InferenceDataset
+from app.core.config import RETRY_AFTER_SECONDS, TTA_VARIANTS
+from app.core.executor import executor
+from app.core.explain import explain_images
+from app.core.metrics import STAGE_SECONDS
+from app.core.predictor import predict_cases, predict_logits
+from app.core.registry import ModelEntry, registry
 
 router = APIRouter()
 
-model = model.EfficientNetModel.load_from_checkpoint(f"{MODEL_PATH}/{MODEL}")
+def _admit():
+    """Shed load with 503 + Retry-After until warmup is done or once the in-flight limit is reached"""
+    if not registry.ready.is_set():
+        raise HTTPException(
+            status_code=503,
+            detail="Inference service is warming up. Retry later.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    if not executor.try_acquire():
+        raise HTTPException(
+            status_code=503,
+            detail="Inference service is at capacity. Retry later.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
 
-@router.post("/predict")
-async def predict(request: Request):
+async def admit_request():
+    _admit()
+    try:
+        yield
+    finally:
+        executor.release()
+
+def _decode_base64(image_b64_list: List[str]) -> List[bytes]:
+    try:
+        return [base64.b64decode(b64_str) for b64_str in image_b64_list]
+    except Exception as e:
+        raise ValueError(f"Image decoding failed: {e}")
+
+def _split_length_prefixed(body: bytes) -> List[memoryview]:
+    """Split a body of [4-byte big-endian length][JPEG bytes] frames without copying the payload"""
+    view = memoryview(body)
+    frames = []
+    offset = 0
+    while offset < len(view):
+        if offset + 4 > len(view):
+            raise ValueError("Truncated length prefix in binary body.")
+        (length,) = struct.unpack_from(">I", view, offset)
+        offset += 4
+        if length == 0 or offset + length > len(view):
+            raise ValueError(f"Invalid frame length {length} at offset {offset - 4}.")
+        frames.append(view[offset:offset + length])
+        offset += length
+    return frames
+
+def _split_cases(body: bytes) -> List[Tuple[str, List[memoryview]]]:
+    """
+    Split a case-keyed binary body. It uses the same length-prefixed framing as /predict/binary, but each
+    case starts with a header frame holding UTF-8 JSON {"case_id": "...", "images": N}, followed by its N
+    image frames.
+    """
+    frames = _split_length_prefixed(body)
+    cases = []
+    seen = set()
+    idx = 0
+    while idx < len(frames):
+        try:
+            header = json.loads(bytes(frames[idx]).decode("utf-8"))
+            case_id, count = str(header["case_id"]), int(header["images"])
+        except Exception as e:
+            raise ValueError(f"Invalid case header at frame {idx}: {e}")
+        if case_id in seen:
+            raise ValueError(f"Duplicate case_id '{case_id}'.")
+        if count <= 0 or idx + 1 + count > len(frames):
+            raise ValueError(f"Case '{case_id}' declares {count} images but the body does not contain them.")
+        cases.append((case_id, frames[idx + 1:idx + 1 + count]))
+        seen.add(case_id)
+        idx += 1 + count
+    return cases
+
+def _resolve_model(model_version: Optional[str]) -> ModelEntry:
+    try:
+        return registry.get(model_version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version '{model_version}' is not loaded.")
+
+async def _predict_images(image_buffers: List[Union[bytes, memoryview]], model_version: Optional[str], tta: bool = False) -> Dict[str, Any]:
+    entry = _resolve_model(model_version)
+    try:
+        logits = await predict_logits(entry, image_buffers, tta=tta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    result = {"predictions": entry.model.decode_predictions(logits), "model_version": entry.version}
+    if tta:
+        result["tta_variants"] = TTA_VARIANTS
+    return result
+
+@router.post("/predict", dependencies=[Depends(admit_request)])
+async def predict(request: Request, model_version: Optional[str] = Query(None), tta: bool = Query(False)):
+    """Body: {"images": [<base64 JPEG>, ...]}. With ?tta=true logits are averaged over TTA_VARIANTS of each image"""
     try:
         body = await request.json()
         image_b64_list = body.get("images", [])
@@ -22,18 +112,99 @@ async def predict(request: Request):
             raise ValueError("Missing or invalid 'images' list in request.")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
-    
-    images = []
-    for b64_str in image_b64_list:
+
+    try:
+        with STAGE_SECONDS.labels("request_decode").time():
+            image_buffers = await executor.run(_decode_base64, image_b64_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return await _predict_images(image_buffers, model_version or body.get("model_version"), tta)
+
+@router.post("/predict/upload", dependencies=[Depends(admit_request)])
+async def predict_upload(images: List[UploadFile] = File(...), model_version: Optional[str] = Query(None), tta: bool = Query(False)):
+    """Multipart/form-data variant of /predict: one 'images' file part per JPEG, in order"""
+    image_buffers = [await image.read() for image in images]
+    if not image_buffers:
+        raise HTTPException(status_code=400, detail="Missing 'images' file parts in request.")
+
+    return await _predict_images(image_buffers, model_version, tta)
+
+@router.post("/predict/binary", dependencies=[Depends(admit_request)])
+async def predict_binary(request: Request, model_version: Optional[str] = Query(None), tta: bool = Query(False)):
+    """
+    Raw application/octet-stream variant of /predict.
+    The body is a sequence of frames, each a 4-byte big-endian length followed by that many JPEG bytes.
+    """
+    body = await request.body()
+    try:
+        image_buffers = _split_length_prefixed(body)
+        if not image_buffers:
+            raise ValueError("Empty binary body.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid binary body: {e}")
+
+    return await _predict_images(image_buffers, model_version, tta)
+
+@router.post("/cases")
+async def predict_case_batch(request: Request, model_version: Optional[str] = Query(None), tta: bool = Query(False)):
+    """
+    Case-keyed variant of /predict/binary (see _split_cases for the body). Streams one NDJSON line per case
+    as soon as that case's images are done: {"case_id", "status": "ok", "predictions", "model_version"} or
+    {"case_id", "status": "error", "error", "retryable"}. A bad image only fails its own case.
+    """
+    body = await request.body()
+    try:
+        cases = _split_cases(body)
+        if not cases:
+            raise ValueError("Empty binary body.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid binary body: {e}")
+
+    # Admission is held until the stream ends, not until the handler returns
+    _admit()
+    try:
+        entry = _resolve_model(model_version)
+    except HTTPException:
+        executor.release()
+        raise
+
+    async def stream():
+        results = predict_cases(entry, cases, tta=tta)
         try:
-            img_bytes = base64.b64decode(b64_str)
-            img = Image.open(BytesIO(img_bytes)).convert("RGB")
-            images.append(img)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Image decoding failed: {e}")
-    
-    dataset = InferenceDataset(images, transform=model.preprocess)
-    dataloader = DataLoader(dataset, batch_size=9, shuffle=False)
-    predictions = model.predict_batch(dataloader=dataloader)
+            async for result in results:
+                if result["status"] == "ok":
+                    result["model_version"] = entry.version
+                yield json.dumps(result) + "\n"
+        finally:
+            try:
+                await results.aclose() # Cancels unfinished cases before their admission slot is given back
+            finally:
+                executor.release()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.post("/explain", dependencies=[Depends(admit_request)])
+async def explain(request: Request, model_version: Optional[str] = Query(None), heatmap_size: Optional[int] = Query(None, ge=1, le=1024)):
+    """
+    Same JSON body as /predict; additionally returns a Grad-CAM heatmap per image as a base64 grayscale PNG.
+    Heatmaps come from the same batched forward pass as the predictions.
+    """
+    try:
+        body = await request.json()
+        image_b64_list = body.get("images", [])
+        if not image_b64_list or not isinstance(image_b64_list, list):
+            raise ValueError("Missing or invalid 'images' list in request.")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+
+    entry = _resolve_model(model_version or body.get("model_version"))
+    try:
+        image_buffers = await executor.run(_decode_base64, image_b64_list)
+        result = await executor.run(explain_images, entry.model, image_buffers, heatmap_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
 
-    return {"predictions": predictions}
\ No newline at end of file
+    return {**result, "model_version": entry.version}
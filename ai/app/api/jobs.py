@@ -0,0 +1,76 @@
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from typing import Optional
+
+from app.api.inference import _split_cases, _split_length_prefixed
+from app.core.config import JOB_CALLBACK_ALLOWED_PREFIXES, RETRY_AFTER_SECONDS
+from app.core.jobs import job_manager
+from app.core.registry import registry
+
+router = APIRouter()
+
+@router.post("")
+async def submit_job(
+    request: Request,
+    model_version: Optional[str] = Query(None),
+    tta: bool = Query(False),
+    callback_url: Optional[str] = Query(None),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Asynchronous variant of /predict/binary (same length-prefixed body). Returns 202 with a job id right away;
+    poll GET /inference/jobs/{job_id} or pass callback_url to have the finished job POSTed back.
+    Resubmitting with the same Idempotency-Key header returns the existing job (200) instead of a new one.
+    """
+    return await _submit(request, model_version, tta, callback_url, idempotency_key, case_keyed=False)
+
+@router.post("/cases")
+async def submit_case_job(
+    request: Request,
+    model_version: Optional[str] = Query(None),
+    tta: bool = Query(False),
+    callback_url: Optional[str] = Query(None),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Asynchronous variant of /inference/cases (same case-keyed body). The job result holds
+    {"cases": {case_id: {"status": "ok", "predictions"} | {"status": "error", "error", "retryable"}}, "model_version"},
+    filled in case by case while the job runs.
+    """
+    return await _submit(request, model_version, tta, callback_url, idempotency_key, case_keyed=True)
+
+async def _submit(request: Request, model_version: Optional[str], tta: bool, callback_url: Optional[str], idempotency_key: Optional[str], case_keyed: bool):
+    if not registry.ready.is_set():
+        raise HTTPException(
+            status_code=503,
+            detail="Inference service is warming up. Retry later.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    if callback_url and not any(callback_url.startswith(prefix) for prefix in JOB_CALLBACK_ALLOWED_PREFIXES):
+        raise HTTPException(status_code=400, detail="callback_url is not in JOB_CALLBACK_ALLOWED_PREFIXES.")
+
+    body = await request.body()
+    image_buffers = cases = None
+    try:
+        if case_keyed:
+            cases = _split_cases(body)
+        else:
+            image_buffers = _split_length_prefixed(body)
+        if not (cases or image_buffers):
+            raise ValueError("Empty binary body.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid binary body: {e}")
+
+    try:
+        job, created = job_manager.submit(image_buffers, model_version, tta, callback_url, idempotency_key, cases=cases)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    return JSONResponse(content=job.to_dict(), status_code=202 if created else 200)
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    try:
+        return job_manager.get(job_id).to_dict()
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
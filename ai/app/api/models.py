@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
+import hmac
+import os
+
+from app.core.cache import prediction_cache
+from app.core.config import ADMIN_TOKEN
+from app.core.executor import executor
+from app.core.registry import registry
+
+router = APIRouter()
+
+def verify_admin_token(request: Request):
+    """Management routes require X-Admin-Token when ADMIN_TOKEN is configured"""
+    if ADMIN_TOKEN and not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+def _validate_version(version) -> str:
+    # Versions are checkpoint file names inside the model cache, never paths
+    if not isinstance(version, str) or os.path.basename(version) != version or not version.endswith(".pth"):
+        raise HTTPException(status_code=400, detail=f"Invalid model version '{version}'.")
+    return version
+
+@router.get("", dependencies=[Depends(verify_admin_token)])
+def list_models():
+    return registry.status()
+
+@router.post("/load", dependencies=[Depends(verify_admin_token)])
+async def load_model(request: Request):
+    """
+    Load a checkpoint in the background. Body: {"version": "<checkpoint>.pth", "make_default": false}
+    With make_default the default is swapped atomically once the new model has warmed up.
+    """
+    body = await request.json()
+    version = _validate_version(body.get("version"))
+    registry.load(version, make_default=bool(body.get("make_default", False)))
+    return JSONResponse(content={"version": version, "status": "loading"}, status_code=202)
+
+@router.post("/default", dependencies=[Depends(verify_admin_token)])
+async def set_default_model(request: Request):
+    body = await request.json()
+    version = _validate_version(body.get("version"))
+    try:
+        registry.set_default(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version '{version}' is not loaded.")
+    return {"default": version}
+
+@router.delete("/{version}", dependencies=[Depends(verify_admin_token)])
+def unload_model(version: str):
+    version = _validate_version(version)
+    try:
+        registry.unload(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version '{version}' is not loaded.")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"unloaded": version}
+
+@router.get("/cache", dependencies=[Depends(verify_admin_token)])
+def cache_stats():
+    return prediction_cache.stats()
+
+@router.get("/autotune", dependencies=[Depends(verify_admin_token)])
+def autotune_report():
+    if registry.autotune_report is None:
+        raise HTTPException(status_code=404, detail="Autotuning has not run yet.")
+    return registry.autotune_report
+
+@router.post("/autotune", dependencies=[Depends(verify_admin_token)])
+async def run_autotune():
+    """Re-run autotuning on the default model. It competes with live traffic, so run it on a quiet instance."""
+    if not registry.ready.is_set():
+        raise HTTPException(status_code=503, detail="No model is loaded yet.")
+    return await executor.run(registry.autotune)
@@ -0,0 +1,83 @@
+import os
+import statistics
+import time
+import torch
+from typing import Any, Dict, List, Optional
+
+from app.core.config import AUTOTUNE_BATCH_SIZES, AUTOTUNE_MAX_BATCH_LATENCY_MS, AUTOTUNE_REPEATS, AUTOTUNE_THREADS
+
+def default_thread_counts() -> List[int]:
+    # torch's current setting is the ceiling: under app.serve it is already the per-worker share of the cores
+    available = torch.get_num_threads()
+    return sorted({1, max(1, available // 2), available})
+
+def _batch_latency_ms(model, batch_size: int, repeats: int) -> float:
+    images = torch.randn(batch_size, 3, model.input_size, model.input_size)
+    model.forward_logits(images) # first pass at a new shape pays for allocations
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.forward_logits(images)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def autotune(
+    model,
+    thread_counts: Optional[List[int]] = None,
+    batch_sizes: List[int] = AUTOTUNE_BATCH_SIZES,
+    max_batch_latency_ms: float = AUTOTUNE_MAX_BATCH_LATENCY_MS,
+    repeats: int = AUTOTUNE_REPEATS
+) -> Dict[str, Any]:
+    """
+    Time forward passes over synthetic input for every thread count and batch size, then apply the thread
+    count of the highest-throughput combination whose batch latency is within max_batch_latency_ms.
+    Returns a report; the caller applies report["batch_size"] to its batchers.
+
+    Only torch intra-op threads can be changed at runtime: inter-op threads are fixed once torch has started,
+    and ONNX Runtime sessions take their thread count at creation, so for onnx models only batch size is tuned.
+    """
+    start = time.perf_counter()
+    if hasattr(model, "session"):
+        thread_counts = [torch.get_num_threads()]
+    else:
+        thread_counts = thread_counts or AUTOTUNE_THREADS or default_thread_counts()
+    original_threads = torch.get_num_threads()
+
+    candidates = []
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        for batch_size in sorted(batch_sizes):
+            latency_ms = _batch_latency_ms(model, batch_size, repeats)
+            candidates.append({
+                "threads": threads,
+                "batch_size": batch_size,
+                "latency_ms": latency_ms,
+                "images_per_second": batch_size * 1000 / latency_ms,
+            })
+            if latency_ms > max_batch_latency_ms:
+                break # larger batches at this thread count only get slower
+
+    within_budget = [c for c in candidates if c["latency_ms"] <= max_batch_latency_ms]
+    if within_budget:
+        best = max(within_budget, key=lambda c: c["images_per_second"])
+    else:
+        best = min(candidates, key=lambda c: c["latency_ms"])
+
+    torch.set_num_threads(best["threads"])
+    report = {
+        "threads": best["threads"],
+        "batch_size": best["batch_size"],
+        "latency_ms": best["latency_ms"],
+        "images_per_second": best["images_per_second"],
+        "previous_threads": original_threads,
+        "max_batch_latency_ms": max_batch_latency_ms,
+        "cpu_count": os.cpu_count(),
+        "candidates": candidates,
+        "duration_seconds": time.perf_counter() - start,
+        "tuned_at": time.time(),
+    }
+    print(
+        f"[Autotune] Picked {best['threads']} threads, batch size {best['batch_size']} "
+        f"({best['images_per_second']:.1f} images/s, {best['latency_ms']:.0f} ms per batch) in {report['duration_seconds']:.1f}s"
+    )
+    return report
@@ -0,0 +1,149 @@
+import asyncio
+from typing import List, Optional, Tuple, Union
+import torch
+
+from app.core.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from app.core.metrics import BATCH_SIZE, IMAGES, STAGE_SECONDS
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching scheduler shared by all concurrent inference requests.
+
+    Each request submits its preprocessed (N, C, H, W) tensor and awaits its own slice of the logits.
+    Requests are merged into one forward pass until the batch holds max_batch_size images or the
+    oldest waiting request has waited max_wait_ms, whichever comes first. When any request in a batch asks for
+    embeddings, the whole pass runs model.forward_embeddings, whose logits are the same; on a model without
+    embeddings only those requests fail.
+    """
+
+    def __init__(self, model, executor=None, max_batch_size: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queued_images = 0
+
+    async def submit(self, images: torch.Tensor, embeddings: bool = False) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Queue a preprocessed batch and return its logits once the merged forward pass has run,
+        or (logits, embeddings) when embeddings is True.
+        """
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+
+        # Requests larger than one batch are split so they can still share passes with other callers
+        futures = []
+        for chunk in torch.split(images, self.max_batch_size):
+            future = loop.create_future()
+            self._queue.put_nowait((chunk, future, loop.time(), embeddings))
+            self.queued_images += len(chunk)
+            futures.append(future)
+
+        results = await asyncio.gather(*futures)
+        if embeddings:
+            return torch.cat([logits for logits, _ in results]), torch.cat([features for _, features in results])
+        return torch.cat(results)
+
+    def close(self):
+        """
+        Stop the worker once queued requests are served, including ones submitted while it drains; a submit after
+        that starts a new worker. Safe to call from any thread.
+        """
+        if self._worker is not None and not self._worker.done():
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    def _ensure_worker(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._loop = asyncio.get_running_loop()
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        carry = None
+        closing = False # Set by the close() sentinel: serve whatever is queued without waiting, then stop
+
+        while True:
+            if carry is not None:
+                first, carry = carry, None
+            elif closing:
+                if self._queue.empty():
+                    return
+                first = self._queue.get_nowait()
+            else:
+                first = await self._queue.get()
+            if first is None:
+                closing = True
+                continue
+            pending = [first]
+            size = len(first[0])
+            deadline = loop.time() + self.max_wait_seconds
+
+            while size < self.max_batch_size:
+                if closing:
+                    if self._queue.empty():
+                        break
+                    item = self._queue.get_nowait()
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    closing = True
+                    continue
+                if size + len(item[0]) > self.max_batch_size:
+                    carry = item # Starts the next batch instead of overfilling this one
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            await self._dispatch(pending)
+
+    async def _dispatch(self, pending: List[Tuple[torch.Tensor, asyncio.Future, float, bool]]):
+        now = asyncio.get_running_loop().time()
+        for images, _, enqueued_at, _ in pending:
+            self.queued_images -= len(images)
+            STAGE_SECONDS.labels("queue").observe(now - enqueued_at)
+        pending = [(images, future, embeddings) for images, future, _, embeddings in pending if not future.done()]
+        if not self.model.supports_embeddings:
+            # Fail only the requests asking for embeddings; the plain ones in the same batch still run
+            for _, future, embeddings in pending:
+                if embeddings:
+                    future.set_exception(NotImplementedError(f"{type(self.model).__name__} does not expose embeddings."))
+            pending = [(images, future, embeddings) for images, future, embeddings in pending if not embeddings]
+        if not pending:
+            return
+
+        with_embeddings = any(embeddings for _, _, embeddings in pending)
+        forward = self.model.forward_embeddings if with_embeddings else self.model.forward_logits
+        try:
+            batch = torch.cat([images for images, _, _ in pending])
+            BATCH_SIZE.observe(len(batch))
+            with STAGE_SECONDS.labels("forward").time():
+                if self.executor is not None:
+                    # Requests keep queueing on the event loop while this pass runs, so the next batch fills up
+                    outputs = await self.executor.run(forward, batch)
+                else:
+                    outputs = forward(batch)
+            IMAGES.inc(len(batch))
+        except Exception as e:
+            for _, future, _ in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logits, features = outputs if with_embeddings else (outputs, None)
+        start = 0
+        for images, future, embeddings in pending:
+            end = start + len(images)
+            if not future.done():
+                future.set_result((logits[start:end], features[start:end]) if embeddings else logits[start:end])
+            start = end
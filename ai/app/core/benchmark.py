@@ -0,0 +1,224 @@
+import base64
+from io import BytesIO
+import json
+import os
+import platform
+import statistics
+import time
+import numpy as np
+from PIL import Image
+import torch
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.model import EfficientNetModel
+from app.core.warmup import synthetic_jpeg
+
+BACKENDS = ("torch", "onnx", "int8")
+PREPROCESS_MODES = ("albumentations", "tensor")
+
+def _time_ms(fn: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    fn() # warmup: lazy allocations and kernel selection are not part of the steady state
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "max_ms": max(timings)}
+
+def _decoder(model, mode: str) -> Callable[[List[bytes]], list]:
+    if mode == "tensor":
+        return lambda buffers: [model.tensor_preprocess.decode(buffer) for buffer in buffers]
+    return lambda buffers: [Image.open(BytesIO(buffer)).convert("RGB") for buffer in buffers]
+
+def _preprocessor(model, mode: str) -> Callable[[list], torch.Tensor]:
+    if mode == "tensor":
+        return model.tensor_preprocess
+    return lambda images: torch.stack([model.preprocess(image=np.array(image))["image"] for image in images])
+
+def load_backend(checkpoint_path: str, backend: str, threads: int):
+    """Serving model for checkpoint_path on the given backend, or None when its artifacts are unavailable"""
+    if backend == "torch":
+        return EfficientNetModel.load_from_checkpoint(checkpoint_path)
+
+    try:
+        from app.core.onnx_model import OnnxEfficientNetModel, export_onnx
+    except ImportError as e:
+        print(f"[Benchmark] Skipping {backend}: {e}")
+        return None
+
+    onnx_path = os.path.splitext(checkpoint_path)[0] + ".onnx"
+    if not os.path.exists(onnx_path):
+        export_onnx(checkpoint_path, onnx_path)
+    if backend == "int8":
+        from app.core.quantization import int8_paths
+        onnx_path = int8_paths(onnx_path)[0]
+        if not os.path.exists(onnx_path):
+            print(f"[Benchmark] Skipping int8: {onnx_path} not found, run `python -m app.core.quantization` first")
+            return None
+    return OnnxEfficientNetModel.load_from_onnx(onnx_path, intra_op_threads=threads)
+
+def benchmark_stages(
+    checkpoint_path: str,
+    buffers: List[bytes],
+    batch_sizes: List[int],
+    thread_counts: List[int],
+    backends: List[str] = BACKENDS,
+    modes: List[str] = PREPROCESS_MODES,
+    repeats: int = 5
+) -> List[Dict[str, Any]]:
+    """
+    Time each inference stage separately for every combination of thread count, batch size, preprocessing
+    mode and backend. Decoding and preprocessing do not depend on the backend and are timed once per mode.
+    """
+    records = []
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        models = {backend: load_backend(checkpoint_path, backend, threads) for backend in backends}
+        models = {backend: model for backend, model in models.items() if model is not None}
+        reference = models.get("torch") or EfficientNetModel.load_from_checkpoint(checkpoint_path)
+
+        for batch_size in batch_sizes:
+            batch_buffers = [buffers[i % len(buffers)] for i in range(batch_size)]
+            request_body = json.dumps({"images": [base64.b64encode(buffer).decode("utf-8") for buffer in batch_buffers]})
+
+            request_decode = _time_ms(lambda: [base64.b64decode(image) for image in json.loads(request_body)["images"]], repeats)
+            for mode in modes:
+                decode, preprocess = _decoder(reference, mode), _preprocessor(reference, mode)
+                images = decode(batch_buffers)
+                batch = preprocess(images)
+                decode_timing = _time_ms(lambda: decode(batch_buffers), repeats)
+                preprocess_timing = _time_ms(lambda: preprocess(images), repeats)
+
+                for backend, model in models.items():
+                    logits = model.forward_logits(batch)
+                    response = {"predictions": model.decode_predictions(logits)}
+                    stages = {
+                        "request_decode": request_decode,
+                        "decode": decode_timing,
+                        "preprocess": preprocess_timing,
+                        "forward": _time_ms(lambda: model.forward_logits(batch), repeats),
+                        "serialize": _time_ms(lambda: json.dumps(response), repeats),
+                    }
+                    total_ms = sum(stage["median_ms"] for stage in stages.values())
+                    records.append({
+                        "backend": backend,
+                        "threads": threads,
+                        "batch_size": batch_size,
+                        "preprocess_mode": mode,
+                        "stages": stages,
+                        "total_ms": total_ms,
+                        "images_per_second": batch_size * 1000 / total_ms,
+                    })
+                    print(
+                        f"[Benchmark] {backend:5s} threads={threads:<2d} batch={batch_size:<3d} {mode:14s} "
+                        + " ".join(f"{name}={stage['median_ms']:.1f}ms" for name, stage in stages.items())
+                    )
+    return records
+
+def benchmark_route(buffers: List[bytes], batch_sizes: List[int], repeats: int = 5) -> List[Dict[str, Any]]:
+    """
+    End-to-end latency of POST /inference/predict in-process, with the configured backend and preprocessing
+    mode. The prediction cache is disabled so every request pays for the full pipeline.
+    """
+    from fastapi.testclient import TestClient
+
+    from app.core.cache import prediction_cache
+    from app.core.config import MODEL
+    from app.core.registry import registry
+    from app.main import app
+
+    prediction_cache.max_entries = 0
+    registry.load(MODEL, make_default=True, background=False)
+
+    records = []
+    with TestClient(app) as client:
+        for batch_size in batch_sizes:
+            images = [base64.b64encode(buffers[i % len(buffers)]).decode("utf-8") for i in range(batch_size)]
+
+            def post():
+                response = client.post("/inference/predict", json={"images": images})
+                response.raise_for_status()
+
+            timing = _time_ms(post, repeats)
+            records.append({"batch_size": batch_size, "threads": torch.get_num_threads(), **timing, "images_per_second": batch_size * 1000 / timing["median_ms"]})
+            print(f"[Benchmark] route batch={batch_size:<3d} median={timing['median_ms']:.1f}ms")
+    return records
+
+def _environment() -> Dict[str, Any]:
+    environment = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+    }
+    try:
+        import onnxruntime
+        environment["onnxruntime"] = onnxruntime.__version__
+    except ImportError:
+        pass
+    return environment
+
+def _load_buffers(images_dir: Optional[str], count: int) -> List[bytes]:
+    if images_dir is None:
+        # Phone-camera sized synthetic photos so decoding cost is realistic without shipping sample data
+        return [synthetic_jpeg(width=1600, height=1200, seed=seed) for seed in range(count)]
+    paths = sorted(os.path.join(images_dir, name) for name in os.listdir(images_dir) if name.lower().endswith((".jpg", ".jpeg", ".png")))
+    if not paths:
+        raise SystemExit(f"No images found in {images_dir}")
+    buffers = []
+    for path in paths[:count]:
+        with open(path, "rb") as f:
+            buffers.append(f.read())
+    return buffers
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+def main():
+    import argparse
+
+    from app.core.config import MODEL, MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Per-stage CPU inference benchmark, written as JSON")
+    parser.add_argument("--checkpoint", default=f"{MODEL_PATH}/{MODEL}", help="Path to the .pth checkpoint")
+    parser.add_argument("--images", help="Folder of sample JPEGs (default: synthetic 1600x1200 JPEGs)")
+    parser.add_argument("--count", type=int, default=9, help="Distinct images to cycle through")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 9, 32])
+    parser.add_argument("--threads", type=_int_list, default=sorted({1, os.cpu_count() or 1}), help="torch / ORT intra-op thread counts")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--modes", default=",".join(PREPROCESS_MODES), help="Preprocessing modes")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--route", action="store_true", help="Also time POST /inference/predict end to end")
+    parser.add_argument("--output", help="JSON output path (default: stdout)")
+    args = parser.parse_args()
+
+    buffers = _load_buffers(args.images, args.count)
+    results = {
+        "environment": _environment(),
+        "checkpoint": os.path.basename(args.checkpoint),
+        "images": {"source": args.images or "synthetic", "count": len(buffers), "mean_bytes": sum(map(len, buffers)) / len(buffers)},
+        "repeats": args.repeats,
+        "stages": benchmark_stages(
+            args.checkpoint,
+            buffers,
+            args.batch_sizes,
+            args.threads,
+            backends=[backend for backend in args.backends.split(",") if backend],
+            modes=[mode for mode in args.modes.split(",") if mode],
+            repeats=args.repeats
+        ),
+    }
+    if args.route:
+        results["route"] = benchmark_route(buffers, args.batch_sizes, repeats=args.repeats)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[Benchmark] Results written to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
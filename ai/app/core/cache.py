@@ -0,0 +1,86 @@
+import asyncio
+from collections import OrderedDict
+import hashlib
+import time
+from typing import Dict, Hashable, Optional, Tuple, Union
+
+import torch
+
+from app.core.config import PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_SECONDS
+
+class PredictionCache:
+    """
+    Content-addressed cache of per-image logits, keyed by model version and the SHA-256 of the encoded image.
+
+    Besides the LRU/TTL store it tracks images that are currently being inferred: a request that needs an
+    image someone else is already computing awaits that computation instead of starting its own. Only used
+    from the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, max_entries: int = PREDICTION_CACHE_SIZE, ttl_seconds: float = PREDICTION_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, torch.Tensor]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(model_version: str, buffer: Union[bytes, memoryview], variant: str = "") -> Tuple[str, str, str]:
+        return (model_version, variant, hashlib.sha256(buffer).hexdigest())
+
+    def get(self, key: Hashable) -> Optional[torch.Tensor]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, logits = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return logits
+
+    def put(self, key: Hashable, logits: torch.Tensor):
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, logits)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def inflight(self, key: Hashable) -> Optional[asyncio.Future]:
+        return self._inflight.get(key)
+
+    def claim(self, key: Hashable) -> asyncio.Future:
+        """Mark key as being computed by the caller, who must later call resolve() or release()"""
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+
+    def resolve(self, key: Hashable, logits: torch.Tensor):
+        self.put(key, logits)
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(logits)
+
+    def release(self, key: Hashable):
+        """Give up a claim without a result; waiters then compute the image themselves"""
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+prediction_cache = PredictionCache()
@@ -1,4 +1,3 @@
-from google.cloud import storage
 import os
 
 if os.getenv("K_SERVICE"):
@@ -11,12 +10,92 @@ else:
 MODEL = "CancerVOPMDVAll_effnetb2_ep30_lr1e-04_wd1e-03_20250801T011129_bp.pth"
 GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
 
+# "torch" (eager PyTorch) or "onnx" (ONNX Runtime, see app.core.onnx_model)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+
+# "fp32" or "int8" (onnx backend only). INT8 is only served once `python -m app.core.quantization`
+# has written a parity report whose agreement with FP32 meets QUANTIZATION_MIN_AGREEMENT
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32")
+QUANTIZATION_MIN_AGREEMENT = float(os.getenv("QUANTIZATION_MIN_AGREEMENT", "0.98"))
+
+# Dynamic micro-batching: images from concurrent requests are merged into one forward pass
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+# Requests with more than PIPELINE_CHUNK_SIZE images are decoded and preprocessed in micro-batches of that size,
+# overlapping with the forward pass of earlier ones; at most PIPELINE_DEPTH micro-batches are decoded at a time
+PIPELINE_CHUNK_SIZE = int(os.getenv("PIPELINE_CHUNK_SIZE", "9")) # 0 disables pipelining
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", "2"))
+
+# CPU-bound work (decoding, preprocessing, forward pass) runs off the event loop with bounded admission
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+MAX_INFLIGHT_REQUESTS = int(os.getenv("MAX_INFLIGHT_REQUESTS", "8"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+
+# Per-image logits cached by (model version, SHA-256 of the encoded image); 0 disables caching and coalescing
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "3600"))
+
+# Asynchronous jobs (/inference/jobs): submission returns a job id right away, results are polled or POSTed to a
+# callback URL. Callbacks are only sent to URLs starting with one of JOB_CALLBACK_ALLOWED_PREFIXES and are signed
+# with JOB_CALLBACK_SECRET (HMAC-SHA256 of the body in X-Job-Signature) when it is set
+JOB_MAX_CONCURRENCY = int(os.getenv("JOB_MAX_CONCURRENCY", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "64"))
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_CALLBACK_ALLOWED_PREFIXES = [prefix for prefix in os.getenv("JOB_CALLBACK_ALLOWED_PREFIXES", "").split(",") if prefix]
+JOB_CALLBACK_SECRET = os.getenv("JOB_CALLBACK_SECRET")
+JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", "10"))
+JOB_CALLBACK_MAX_RETRIES = int(os.getenv("JOB_CALLBACK_MAX_RETRIES", "3"))
+
+# Test-time augmentation (opt-in per request with ?tta=true): logits are averaged over these deterministic
+# variants of each preprocessed image, at len(TTA_VARIANTS) times the forward cost
+TTA_VARIANTS = [variant for variant in os.getenv("TTA_VARIANTS", "identity,hflip,vflip,rot90,rot180,rot270").split(",") if variant]
+
+# "albumentations" (per-image reference pipeline) or "tensor" (batched, see app.core.preprocessing)
+# Run `python -m app.core.preprocessing <images_dir>` to check parity before switching
+PREPROCESS_MODE = os.getenv("PREPROCESS_MODE", "albumentations")
+JPEG_DRAFT_DECODE = os.getenv("JPEG_DRAFT_DECODE", "true").lower() == "true"
+
+# Startup: the checkpoint is served from a SHA-256 verified local cache (see app.core.model_cache) and only
+# fetched from MODEL_BUCKET when the cache is missing or stale. Warmup runs in the background before /ready
+MODEL_SHA256 = os.getenv("MODEL_SHA256") # Optional pinned hash of the checkpoint
+MODEL_BUCKET = f"{GOOGLE_CLOUD_PROJECT}.firebasestorage.app"
+MODEL_BUCKET_PREFIX = "memosa_ai_models"
+WARMUP_BATCH_SIZES = [int(size) for size in os.getenv("WARMUP_BATCH_SIZES", "1,9").split(",") if size]
+
+# Autotuning: after warmup (before /ready) the default model is timed on synthetic input for each intra-op thread
+# count (default: 1, half and all of the current torch threads) and batch size; the highest-throughput combination
+# whose batch latency stays within AUTOTUNE_MAX_BATCH_LATENCY_MS is applied. Also available as POST /models/autotune
+AUTOTUNE_ON_STARTUP = os.getenv("AUTOTUNE_ON_STARTUP", "true").lower() == "true"
+AUTOTUNE_THREADS = [int(threads) for threads in os.getenv("AUTOTUNE_THREADS", "").split(",") if threads]
+AUTOTUNE_BATCH_SIZES = [int(size) for size in os.getenv("AUTOTUNE_BATCH_SIZES", "1,4,9,16,32").split(",") if size]
+AUTOTUNE_MAX_BATCH_LATENCY_MS = float(os.getenv("AUTOTUNE_MAX_BATCH_LATENCY_MS", "2000"))
+AUTOTUNE_REPEATS = int(os.getenv("AUTOTUNE_REPEATS", "2"))
+# Under app.serve only worker 0 tunes at startup; the other workers wait up to AUTOTUNE_SHARED_WAIT_SECONDS for its
+# report (and only then warm up, so they do not load the CPUs it is measuring) and apply it
+AUTOTUNE_SHARED_WAIT_SECONDS = float(os.getenv("AUTOTUNE_SHARED_WAIT_SECONDS", "600"))
+
+# Multi-process serving (`python -m app.serve`): the checkpoint is loaded once and its weights shared read-only
+# by SERVE_WORKERS forked worker processes accepting on one socket, each limited to SERVE_THREADS_PER_WORKER torch threads
+SERVE_THREADS_PER_WORKER = int(os.getenv("SERVE_THREADS_PER_WORKER", "1"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(max(1, (os.cpu_count() or 1) // SERVE_THREADS_PER_WORKER))))
+
+# Image embeddings (the pooled backbone features behind the logits) are stored per case image as float16, one store
+# per model version under EMBEDDING_STORE_DIR. On Cloud Run point it at a shared volume that supports POSIX locks
+# (e.g. a Filestore NFS mount): the /tmp default is per instance and lost on every cold start. Similar-case search is exact
+# brute force until a version holds EMBEDDING_ANN_MIN_VECTORS images, then an IVF index (k-means lists,
+# EMBEDDING_IVF_NPROBE lists scanned per query image) narrows the candidates
+EMBEDDING_ANN_MIN_VECTORS = int(os.getenv("EMBEDDING_ANN_MIN_VECTORS", "50000"))
+EMBEDDING_IVF_LISTS = int(os.getenv("EMBEDDING_IVF_LISTS", "0")) # 0 = square root of the stored images
+EMBEDDING_IVF_NPROBE = int(os.getenv("EMBEDDING_IVF_NPROBE", "8"))
+
+# Model registry: several checkpoints can be loaded at once; idle non-default ones are evicted (LRU) above the budget
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "1024"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") # Required as X-Admin-Token on /models management routes when set
+
 if GOOGLE_CLOUD_RUN:
-    MODEL_PATH = "/tmp/models" # absolute path
-    try:
-        os.makedirs(MODEL_PATH, exist_ok=True)
-        storage.Client().bucket(f"{GOOGLE_CLOUD_PROJECT}.firebasestorage.app").blob(f"memosa_ai_models/{MODEL}").download_to_filename(f"{MODEL_PATH}/{MODEL}")
-    except Exception as e:
-        raise Exception(f"Error downloading model: {e}")
+    MODEL_PATH = os.getenv("MODEL_CACHE_DIR", "/tmp/models") # absolute path
+    EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "/tmp/embeddings")
 else:
-    MODEL_PATH = "models" # relative path
+    MODEL_PATH = os.getenv("MODEL_CACHE_DIR", "models") # relative path
+    EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "embeddings")
@@ -0,0 +1,359 @@
+from contextlib import contextmanager
+import fcntl
+import json
+import math
+import numpy as np
+import os
+from threading import RLock
+from typing import Any, Dict, List, Optional
+import uuid
+
+from app.core.config import EMBEDDING_ANN_MIN_VECTORS, EMBEDDING_IVF_LISTS, EMBEDDING_IVF_NPROBE, EMBEDDING_STORE_DIR, GOOGLE_CLOUD_RUN
+
+# Rows scored per matrix product, so brute force never materializes a float32 copy of the whole store
+SCAN_BLOCK_ROWS = 65536
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows as float32, so cosine similarity is a dot product"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+class IvfIndex:
+    """
+    Inverted-file approximate index: rows are bucketed by their nearest k-means centroid, and a query only
+    scores the rows in its nprobe nearest buckets.
+    """
+
+    def __init__(self, centroids: np.ndarray):
+        self.centroids = centroids
+        self.lists: List[List[int]] = [[] for _ in range(len(centroids))]
+        self.trained_rows = 0
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, num_lists: int, iterations: int = 10, seed: int = 0) -> "IvfIndex":
+        """Spherical k-means on (at most 256 rows per list of) the normalized float16 vectors"""
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), num_lists * 256)
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))].astype(np.float32)
+        centroids = sample[rng.choice(sample_size, num_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignments, kind="stable")
+            list_ids, starts = np.unique(assignments[order], return_index=True)
+            sums = centroids.copy() # empty lists keep their centroid
+            sums[list_ids] = np.add.reduceat(sample[order], starts, axis=0)
+            centroids = normalize(sums)
+        index = cls(centroids)
+        index.trained_rows = len(vectors)
+        return index
+
+    def add(self, first_row: int, vectors: np.ndarray):
+        for start in range(0, len(vectors), SCAN_BLOCK_ROWS):
+            block = vectors[start:start + SCAN_BLOCK_ROWS].astype(np.float32)
+            for offset, list_id in enumerate(np.argmax(block @ self.centroids.T, axis=1)):
+                self.lists[list_id].append(first_row + start + offset)
+
+    def candidates(self, queries: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, len(self.centroids))
+        probed = np.unique(np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe])
+        rows = [self.lists[list_id] for list_id in probed if self.lists[list_id]]
+        return np.unique(np.concatenate(rows)).astype(np.int64) if rows else np.empty(0, dtype=np.int64)
+
+class EmbeddingIndex:
+    """
+    Embeddings of every stored case image for one model version: a float16 matrix of L2-normalized rows
+    plus the (case_id, image_index) of each row.
+
+    On disk it is an append-only pair of files: <name>.f16 holds the raw rows and <name>.jsonl one line per
+    stored case. Storing a case again supersedes its earlier rows; superseded rows are dropped when the
+    files are compacted. Several processes can share the files (app.serve workers, or instances mounting the
+    same volume): writers hold an exclusive POSIX lock on <name>.lock, readers a shared one, and every
+    operation first reads what other processes appended since, or reloads after a compaction replaced the
+    files (each compaction writes a new generation token into the lock file). Thread-safe.
+    """
+
+    def __init__(self, path_prefix: str):
+        self.vectors_path = path_prefix + ".f16"
+        self.cases_path = path_prefix + ".jsonl"
+        self._lock = RLock()
+        self._lock_depth = 0
+        self._lock_file = open(path_prefix + ".lock", "a+")
+        self._reset()
+        with self._locked(exclusive=True):
+            self._sync()
+            if self.images < self._size or self._has_unread_bytes():
+                self._compact()
+        print(f"[Embeddings] Loaded {self.images} image embeddings of {self.cases} cases from {self.cases_path}.")
+
+    def _reset(self):
+        self.dim: Optional[int] = None
+        self._vectors = np.empty((0, 0), dtype=np.float16) # capacity grows by doubling; rows past _size are unused
+        self._size = 0
+        self._live = np.empty(0, dtype=bool)
+        self._row_case: List[str] = []
+        self._row_image: List[int] = []
+        self._case_rows: Dict[str, range] = {}
+        self._ivf: Optional[IvfIndex] = None
+        # How far the files have been read, and in which generation (a compaction replaces them)
+        self._generation: Optional[str] = None
+        self._cases_offset = 0
+        self._vectors_offset = 0
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        """Thread lock plus cross-process file lock; nested uses keep the outermost file lock"""
+        with self._lock:
+            if self._lock_depth == 0:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+
+    @property
+    def cases(self) -> int:
+        return len(self._case_rows)
+
+    @property
+    def images(self) -> int:
+        return int(self._live[:self._size].sum())
+
+    def _append_rows(self, case_id: str, vectors: np.ndarray) -> int:
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._vectors = np.empty((0, self.dim), dtype=np.float16)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store's {self.dim}.")
+
+        if self._size + len(vectors) > len(self._vectors):
+            capacity = max(1024, 2 * len(self._vectors), self._size + len(vectors))
+            grown = np.empty((capacity, self.dim), dtype=np.float16)
+            grown[:self._size] = self._vectors[:self._size]
+            live = np.zeros(capacity, dtype=bool)
+            live[:self._size] = self._live[:self._size]
+            self._vectors, self._live = grown, live
+
+        first_row = self._size
+        self._vectors[first_row:first_row + len(vectors)] = vectors
+        self._live[first_row:first_row + len(vectors)] = True
+        self._size += len(vectors)
+        self._row_case.extend([case_id] * len(vectors))
+        self._row_image.extend(range(len(vectors)))
+
+        previous = self._case_rows.get(case_id)
+        if previous is not None:
+            self._live[previous.start:previous.stop] = False
+        self._case_rows[case_id] = range(first_row, self._size)
+        if self._ivf is not None:
+            self._ivf.add(first_row, vectors)
+        return first_row
+
+    def _sync(self):
+        """Read the cases appended since the last call, by any process. Caller holds the file lock."""
+        try:
+            stat = os.stat(self.cases_path)
+        except FileNotFoundError:
+            if self._generation is not None:
+                self._reset() # The store was deleted
+            return
+        generation = self._read_generation()
+        if generation != self._generation or stat.st_size < self._cases_offset:
+            self._reset() # First load, or another process compacted the files
+            self._generation = generation
+        if stat.st_size == self._cases_offset:
+            return
+
+        with open(self.cases_path, "rb") as f:
+            f.seek(self._cases_offset)
+            lines = f.read().split(b"\n")
+        raw = np.empty(0, dtype=np.float16)
+        if os.path.exists(self.vectors_path):
+            with open(self.vectors_path, "rb") as f:
+                f.seek(self._vectors_offset)
+                raw = np.fromfile(f, dtype=np.float16)
+
+        offset = 0
+        for line in lines[:-1]: # a crash mid-append can only leave a partial last line without its newline
+            record = json.loads(line)
+            end = offset + record["images"] * record["dim"]
+            if end > len(raw):
+                break
+            self._append_rows(record["case_id"], raw[offset:end].reshape(record["images"], record["dim"]))
+            offset = end
+            self._cases_offset += len(line) + 1
+        self._vectors_offset += offset * raw.itemsize
+
+    def _has_unread_bytes(self) -> bool:
+        """Whether the files end with leftovers of a crashed append (rows without their case line, or a partial line)"""
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        cases_size = os.path.getsize(self.cases_path) if os.path.exists(self.cases_path) else 0
+        return vectors_size != self._vectors_offset or cases_size != self._cases_offset
+
+    def _read_generation(self) -> str:
+        self._lock_file.seek(0)
+        return self._lock_file.read()
+
+    def _mark_read(self):
+        """Record the files as fully read, after this process wrote them under the exclusive lock"""
+        self._generation = self._read_generation()
+        self._cases_offset = os.path.getsize(self.cases_path)
+        self._vectors_offset = os.path.getsize(self.vectors_path)
+
+    def _compact(self):
+        """Rewrite both files with only live rows, in case order. Caller holds the exclusive file lock."""
+        records = [(case_id, np.array(self._vectors[rows.start:rows.stop])) for case_id, rows in self._case_rows.items()]
+        self._reset()
+        for case_id, vectors in records:
+            self._append_rows(case_id, vectors)
+
+        with open(self.vectors_path + ".tmp", "wb") as vectors_file, open(self.cases_path + ".tmp", "w") as cases_file:
+            for case_id, vectors in records:
+                self._write_case(vectors_file, cases_file, case_id, vectors)
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.cases_path + ".tmp", self.cases_path)
+        # File identity is no proof of freshness (a replaced file can reuse an inode number), a new token is
+        self._lock_file.truncate(0)
+        self._lock_file.write(uuid.uuid4().hex)
+        self._lock_file.flush()
+        self._mark_read()
+
+    @staticmethod
+    def _write_case(vectors_file, cases_file, case_id: str, vectors: np.ndarray):
+        # Rows first: a case line is only written once all of its rows are on disk
+        vectors.tofile(vectors_file)
+        vectors_file.flush()
+        cases_file.write(json.dumps({"case_id": case_id, "images": len(vectors), "dim": vectors.shape[1]}) + "\n")
+
+    def add(self, case_id: str, embeddings: np.ndarray):
+        """Store (or replace) the embeddings of all images of a case, in image order"""
+        vectors = normalize(embeddings).astype(np.float16)
+        with self._locked(exclusive=True):
+            self._sync()
+            if self._has_unread_bytes():
+                # Appending after a crashed writer's leftovers would misalign every later row
+                self._compact()
+            self._append_rows(case_id, vectors)
+            with open(self.vectors_path, "ab") as vectors_file, open(self.cases_path, "a") as cases_file:
+                self._write_case(vectors_file, cases_file, case_id, vectors)
+            self._mark_read()
+
+    def remove(self, case_id: str) -> bool:
+        with self._locked(exclusive=True):
+            self._sync()
+            rows = self._case_rows.pop(case_id, None)
+            if rows is None:
+                return False
+            self._live[rows.start:rows.stop] = False
+            self._compact()
+            return True
+
+    def build_ivf(self, num_lists: int = EMBEDDING_IVF_LISTS) -> IvfIndex:
+        with self._locked():
+            self._sync()
+            live_rows = np.flatnonzero(self._live[:self._size])
+            num_lists = num_lists or max(1, int(math.sqrt(len(live_rows))))
+            index = IvfIndex.train(self._vectors[live_rows], min(num_lists, len(live_rows)))
+            index.add(0, self._vectors[:self._size])
+            self._ivf = index
+            print(f"[Embeddings] Built IVF index with {num_lists} lists over {len(live_rows)} images.")
+            return index
+
+    def _candidate_rows(self, queries: np.ndarray, exact: bool, nprobe: int) -> Optional[np.ndarray]:
+        """Rows to score, or None for all of them (brute force)"""
+        if exact or self.images < EMBEDDING_ANN_MIN_VECTORS:
+            return None
+        if self._ivf is None or self._size > 2 * self._ivf.trained_rows:
+            # Lists are retrained once the store has doubled: appended rows drift from the old centroids
+            self.build_ivf()
+        return self._ivf.candidates(queries, nprobe)
+
+    def search(self, embeddings: np.ndarray, k: int = 10, exclude_case_id: Optional[str] = None, exact: bool = False, nprobe: int = EMBEDDING_IVF_NPROBE) -> List[Dict[str, Any]]:
+        """
+        The k stored cases most similar to a set of query images (e.g. all photos of one lesion). A case scores
+        the highest cosine similarity between any of its images and any query image.
+        """
+        queries = normalize(embeddings)
+        with self._locked():
+            self._sync()
+            if self._size == 0:
+                return []
+            if queries.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {queries.shape[1]} does not match the store's {self.dim}.")
+
+            rows = self._candidate_rows(queries, exact, nprobe)
+            if rows is None:
+                rows = np.arange(self._size)
+            rows = rows[self._live[rows]]
+            if exclude_case_id in self._case_rows:
+                excluded = self._case_rows[exclude_case_id]
+                rows = rows[(rows < excluded.start) | (rows >= excluded.stop)]
+
+            best_scores = np.empty(len(rows), dtype=np.float32)
+            best_queries = np.empty(len(rows), dtype=np.int64)
+            for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+                scores = self._vectors[rows[start:start + SCAN_BLOCK_ROWS]].astype(np.float32) @ queries.T
+                best_queries[start:start + len(scores)] = np.argmax(scores, axis=1)
+                best_scores[start:start + len(scores)] = np.max(scores, axis=1)
+
+            # Best rows first until k distinct cases are found; cases hold few images, so a small top slice usually suffices
+            results, seen = [], set()
+            top = min(len(rows), max(k * 16, 64))
+            while True:
+                order = np.argpartition(-best_scores, top - 1)[:top] if top < len(rows) else np.arange(len(rows))
+                order = order[np.argsort(-best_scores[order], kind="stable")]
+                for position in order:
+                    case_id = self._row_case[rows[position]]
+                    if case_id in seen:
+                        continue
+                    seen.add(case_id)
+                    results.append({
+                        "case_id": case_id,
+                        "score": float(best_scores[position]),
+                        "image_index": self._row_image[rows[position]],
+                        "query_index": int(best_queries[position]),
+                    })
+                    if len(results) == k:
+                        return results
+                if top >= len(rows):
+                    return results
+                results, seen, top = [], set(), len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._locked():
+            self._sync()
+            return {
+                "cases": self.cases,
+                "images": self.images,
+                "dim": self.dim,
+                "bytes": self._size * (self.dim or 0) * 2,
+                "ivf_lists": len(self._ivf.centroids) if self._ivf is not None else None,
+                "ivf_trained_images": self._ivf.trained_rows if self._ivf is not None else None,
+            }
+
+class EmbeddingStore:
+    """One EmbeddingIndex per model version (features of different checkpoints are not comparable), opened on first use"""
+
+    def __init__(self, directory: str = EMBEDDING_STORE_DIR):
+        self.directory = directory
+        self._indexes: Dict[str, EmbeddingIndex] = {}
+        self._lock = RLock()
+        if GOOGLE_CLOUD_RUN and os.path.abspath(directory).startswith("/tmp"):
+            print(f"[Embeddings] Warning: store in {directory} is local to this instance and lost on restart; set EMBEDDING_STORE_DIR to a shared volume.")
+
+    def get(self, model_version: str) -> EmbeddingIndex:
+        with self._lock:
+            index = self._indexes.get(model_version)
+            if index is None:
+                os.makedirs(self.directory, exist_ok=True)
+                index = EmbeddingIndex(os.path.join(self.directory, os.path.splitext(os.path.basename(model_version))[0]))
+                self._indexes[model_version] = index
+            return index
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {version: index.stats() for version, index in self._indexes.items()}
+
+embedding_store = EmbeddingStore()
@@ -0,0 +1,46 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+from app.core.config import INFERENCE_WORKERS, MAX_INFLIGHT_REQUESTS
+
+class InferenceExecutor:
+    """
+    Dedicated thread pool for the CPU-bound inference stages, plus an admission counter.
+
+    Base64/JPEG decoding, preprocessing and the torch forward pass all release the GIL for most of
+    their work, so running them here keeps the event loop free to serve other routes. Requests beyond
+    max_inflight are refused up front rather than queued until the platform times them out.
+    """
+
+    def __init__(self, max_workers: int = INFERENCE_WORKERS, max_inflight: int = MAX_INFLIGHT_REQUESTS):
+        self.max_workers = max_workers
+        self.max_inflight = max_inflight
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._inflight = 0
+        self._lock = Lock()
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                return False
+            self._inflight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+executor = InferenceExecutor()
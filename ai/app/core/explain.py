@@ -0,0 +1,37 @@
+import base64
+from io import BytesIO
+from PIL import Image
+import torch
+import torch.nn.functional as F
+from typing import Any, Dict, List, Optional, Union
+
+from app.core.config import BATCH_MAX_SIZE
+from app.core.preprocessing import decode_and_preprocess
+
+def encode_heatmap(cam: torch.Tensor) -> str:
+    """Encode an (h, w) map in [0, 1] as a base64 8-bit grayscale PNG"""
+    pixels = (cam * 255).round_().clamp_(0, 255).to(torch.uint8).numpy()
+    buffer = BytesIO()
+    Image.fromarray(pixels, mode="L").save(buffer, format="PNG", optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+def explain_images(model, image_buffers: List[Union[bytes, memoryview]], heatmap_size: Optional[int] = None, batch_size: int = BATCH_MAX_SIZE) -> Dict[str, Any]:
+    """
+    Predictions plus Grad-CAM heatmaps for encoded images, computed in batches of batch_size.
+    Heatmaps are upsampled to heatmap_size (the model input size by default) and aligned with the
+    resized model input, so clients stretch them over the original photo.
+    """
+    if getattr(model, "target_layer", None) is None:
+        raise NotImplementedError("Grad-CAM requires the torch inference backend.")
+
+    heatmap_size = heatmap_size or model.input_size
+
+    predictions, heatmaps = [], []
+    for start in range(0, len(image_buffers), batch_size):
+        # Decode per batch so only batch_size full-resolution images are held at once
+        logits, cams = model.grad_cam(decode_and_preprocess(model, image_buffers[start:start + batch_size]))
+        cams = F.interpolate(cams.unsqueeze(1), size=(heatmap_size, heatmap_size), mode="bilinear", align_corners=False).squeeze(1)
+        predictions.extend(model.decode_predictions(logits))
+        heatmaps.extend(encode_heatmap(cam) for cam in cams)
+
+    return {"predictions": predictions, "heatmaps": heatmaps, "heatmap_size": heatmap_size}
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import hmac
+import httpx
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from app.core.config import (
+    JOB_CALLBACK_MAX_RETRIES,
+    JOB_CALLBACK_SECRET,
+    JOB_CALLBACK_TIMEOUT_SECONDS,
+    JOB_MAX_CONCURRENCY,
+    JOB_MAX_QUEUED,
+    JOB_RESULT_TTL_SECONDS
+)
+from app.core.predictor import predict_cases, predict_logits
+from app.core.registry import registry
+
+class Job:
+    """
+    One submitted batch: either a flat image list (image_buffers) or case-keyed images (cases), whose
+    per-case results fill result["cases"] as each case finishes.
+    """
+
+    def __init__(
+        self,
+        image_buffers: Optional[List[Union[bytes, memoryview]]],
+        model_version: Optional[str],
+        tta: bool,
+        callback_url: Optional[str],
+        idempotency_key: Optional[str],
+        cases: Optional[List[Tuple[str, List[Union[bytes, memoryview]]]]] = None
+    ):
+        self.id = uuid.uuid4().hex
+        self.image_buffers = image_buffers
+        self.cases = cases
+        if cases is not None:
+            self.num_images = sum(len(buffers) for _, buffers in cases)
+        else:
+            self.num_images = len(image_buffers)
+        self.model_version = model_version
+        self.tta = tta
+        self.callback_url = callback_url
+        self.idempotency_key = idempotency_key
+        self.status = "queued" # queued -> running -> succeeded | failed
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "images": self.num_images,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+class JobManager:
+    """
+    In-memory asynchronous inference jobs.
+
+    A submitted batch gets a job id immediately and runs in the background through the same cache, batcher
+    and executor as the synchronous routes, at most max_concurrency jobs at a time. Submissions that repeat
+    an idempotency key get the existing job back instead of queueing the same work twice, unless that job failed:
+    a failed job releases its key so the retry runs again. Finished jobs are
+    kept for result_ttl_seconds so late polls still find them. Only used from the event loop thread.
+    """
+
+    def __init__(self, max_concurrency: int = JOB_MAX_CONCURRENCY, max_queued: int = JOB_MAX_QUEUED, result_ttl_seconds: float = JOB_RESULT_TTL_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.result_ttl_seconds = result_ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, str] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def get(self, job_id: str) -> Job:
+        return self._jobs[job_id]
+
+    def submit(
+        self,
+        image_buffers: Optional[List[Union[bytes, memoryview]]] = None,
+        model_version: Optional[str] = None,
+        tta: bool = False,
+        callback_url: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        cases: Optional[List[Tuple[str, List[Union[bytes, memoryview]]]]] = None
+    ) -> Tuple[Job, bool]:
+        """Queue a job; returns (job, created). Raises RuntimeError when too many jobs are unfinished"""
+        self._expire()
+        if idempotency_key and idempotency_key in self._by_key:
+            return self._jobs[self._by_key[idempotency_key]], False
+        if sum(not job.finished for job in self._jobs.values()) >= self.max_queued:
+            raise RuntimeError("Job queue is full.")
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        job = Job(image_buffers, model_version, tta, callback_url, idempotency_key, cases=cases)
+        self._jobs[job.id] = job
+        if idempotency_key:
+            self._by_key[idempotency_key] = job.id
+
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        print(f"[Jobs] Queued job {job.id} with {job.num_images} images.")
+        return job, True
+
+    async def _run(self, job: Job):
+        async with self._semaphore:
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                entry = registry.get(job.model_version)
+                if job.cases is not None:
+                    # Polls see each case as soon as it is done; case failures do not fail the job
+                    job.result = {"cases": {}, "model_version": entry.version}
+                    async for case_result in predict_cases(entry, job.cases, tta=job.tta):
+                        job.result["cases"][case_result.pop("case_id")] = case_result
+                else:
+                    logits = await predict_logits(entry, job.image_buffers, tta=job.tta)
+                    job.result = {"predictions": entry.model.decode_predictions(logits), "model_version": entry.version}
+                job.status = "succeeded"
+            except KeyError:
+                job.error = f"Model version '{job.model_version}' is not loaded."
+                job.status = "failed"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                if job.status == "failed":
+                    self._forget_key(job)
+                job.image_buffers = job.cases = None # results are small, request bodies are not
+                job.finished_at = time.time()
+        print(f"[Jobs] Job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s.")
+
+        if job.callback_url:
+            await self._deliver(job)
+
+    async def _deliver(self, job: Job):
+        body = json.dumps(job.to_dict()).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if JOB_CALLBACK_SECRET:
+            headers["X-Job-Signature"] = hmac.new(JOB_CALLBACK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+        async with httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT_SECONDS) as client:
+            for attempt in range(JOB_CALLBACK_MAX_RETRIES):
+                try:
+                    response = await client.post(job.callback_url, content=body, headers=headers)
+                    response.raise_for_status()
+                    return
+                except Exception as e:
+                    print(f"[Jobs] Callback for job {job.id} failed (attempt {attempt + 1}/{JOB_CALLBACK_MAX_RETRIES}): {e}")
+                    if attempt < JOB_CALLBACK_MAX_RETRIES - 1:
+                        await asyncio.sleep(2 ** attempt)
+        # The result stays pollable until it expires
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]:
+            self._forget_key(self._jobs.pop(job_id))
+
+    def _forget_key(self, job: Job):
+        # The key may already map to a newer job submitted after this one failed
+        if job.idempotency_key and self._by_key.get(job.idempotency_key) == job.id:
+            del self._by_key[job.idempotency_key]
+
+job_manager = JobManager()
@@ -0,0 +1,50 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Under `python -m app.serve` every worker process writes its own values and /metrics merges them (see app.serve):
+# counters and histograms are summed, the gauges below are summed over live workers
+
+# Latency buckets from a cache hit (sub-millisecond) up to a large multi-case flush on a cold instance
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Pipeline stages: request_decode (base64), decode (JPEG), preprocess, queue (waiting for a batch), forward
+STAGE_SECONDS = Histogram(
+    "ai_inference_stage_seconds",
+    "Time spent in each inference pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "ai_http_request_seconds",
+    "End-to-end HTTP request latency",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+BATCH_SIZE = Histogram(
+    "ai_inference_batch_size",
+    "Images per merged forward pass",
+    buckets=(1, 2, 4, 8, 9, 16, 18, 24, 27, 32, 48, 64)
+)
+IMAGES = Counter(
+    "ai_inference_images_total",
+    "Images run through the model; rate() gives images per second"
+)
+INFLIGHT_REQUESTS = Gauge(
+    "ai_inference_inflight_requests",
+    "Admitted inference requests currently being served",
+    multiprocess_mode="livesum"
+)
+QUEUE_DEPTH = Gauge(
+    "ai_inference_queue_depth",
+    "Preprocessed images waiting in the micro-batching queues",
+    multiprocess_mode="livesum"
+)
+CACHE_LOOKUPS = Counter(
+    "ai_prediction_cache_lookups_total",
+    "Per-image prediction cache lookups by outcome (hit, miss, coalesced)",
+    ["outcome"]
+)
+CACHE_ENTRIES = Gauge(
+    "ai_prediction_cache_entries",
+    "Per-image results held in the prediction cache",
+    multiprocess_mode="livesum"
+)
@@ -2,14 +2,20 @@ from abc import ABC, abstractmethod
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
 import cv2
+import os
 import torch
 from torch import nn
 from torch.utils.data import DataLoader
 from torchvision import models
-from typing import List
+from typing import List, Optional, Tuple
+
+from app.core.config import INFERENCE_BACKEND, JPEG_DRAFT_DECODE, MODEL_PRECISION
+from app.core.preprocessing import TensorPreprocessor
 
 class BaseModel(ABC):
     """Base class for all models with common functionality"""
+
+    supports_embeddings = False # Whether forward_embeddings is implemented
     
     def __init__(self, num_classes, pretrained=True, version=None, freeze_base=False, dataset=None, model_name=None):
         self.num_classes = num_classes
@@ -35,33 +41,57 @@ class BaseModel(ABC):
     def load_from_checkpoint(cls, path):
         """Factory method to create model from checkpoint"""
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        checkpoint = torch.load(path, map_location=device, weights_only=False)
+        try:
+            # Memory-map the zipfile checkpoint so weights are paged in from disk instead of read and copied
+            checkpoint = torch.load(path, map_location=device, weights_only=False, mmap=True)
+            mmapped = True
+        except RuntimeError:
+            # Legacy (non-zipfile) checkpoints cannot be memory-mapped
+            checkpoint = torch.load(path, map_location=device, weights_only=False)
+            mmapped = False
         model = cls(
             num_classes=checkpoint['num_classes'],
-            pretrained=True, # hardcoded
+            pretrained=False, # weights come from the checkpoint, no ImageNet download needed
             version=checkpoint["model_version"],
             # augment=True, # hardcoded
             freeze_base=False, # hardcoded
             dataset=checkpoint["model_dataset"],
             model_name=checkpoint["model_name"]
             )
-        model.model.load_state_dict(checkpoint['model_state_dict'])
+        model.model.load_state_dict(checkpoint['model_state_dict'], assign=mmapped and device.type == "cpu")
         return model
     
     def predict_batch(self, dataloader: DataLoader) -> List[str]:
-        self.model.eval()
         predictions = []
-        
-        with torch.no_grad():
-            for images in dataloader:
-                images = images.to(self.device)
-                outputs = self.model(images)
-                predicted_labels = torch.argmax(outputs, dim=1).cpu().numpy()
-                predictions.extend([self.label_mapping[i] for i in predicted_labels])
+        for images in dataloader:
+            outputs = self.forward_logits(images)
+            predictions.extend(self.decode_predictions(outputs))
 
         return predictions
 
+    def forward_logits(self, images: torch.Tensor) -> torch.Tensor:
+        """Run one forward pass over an already preprocessed (N, C, H, W) batch and return CPU logits"""
+        self.model.eval()
+        with torch.no_grad():
+            outputs = self.model(images.to(self.device))
+        return outputs.cpu()
+
+    def forward_embeddings(self, images: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Like forward_logits, but also return the penultimate-layer features the logits were computed from"""
+        raise NotImplementedError(f"{type(self).__name__} does not expose embeddings.")
+
+    def decode_predictions(self, logits: torch.Tensor) -> List[str]:
+        predicted_labels = torch.argmax(logits, dim=1).tolist()
+        return [self.label_mapping[i] for i in predicted_labels]
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the loaded weights, used for the model registry's memory budget"""
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
 class EfficientNetModel(BaseModel):
+    supports_embeddings = True
+
     def __init__(self, num_classes=6, pretrained=True, version="b3", freeze_base=False, dataset=None, model_name=None):
         super().__init__(
             num_classes=num_classes,
@@ -82,6 +112,7 @@ class EfficientNetModel(BaseModel):
 
         model_metadata = models.get_model_weights(model_fn).DEFAULT
         input_size = model_metadata.transforms().crop_size[0]
+        self.input_size = input_size
         self.mean = model_metadata.transforms().mean
         self.std = model_metadata.transforms().std
 
@@ -92,6 +123,12 @@ class EfficientNetModel(BaseModel):
             input_size=input_size, 
             augment=False
         )
+        self.tensor_preprocess = TensorPreprocessor(
+            input_size=input_size,
+            mean=self.mean,
+            std=self.std,
+            draft=JPEG_DRAFT_DECODE
+        )
 
         self.target_layer = self._get_last_conv_layer()
 
@@ -138,4 +175,70 @@ class EfficientNetModel(BaseModel):
         return transformation
     
     def _get_last_conv_layer(self):
-        return self.model.features[-1]
\ No newline at end of file
+        return self.model.features[-1]
+
+    def forward_embeddings(self, images: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Logits and pooled backbone features (the classifier input) for a preprocessed (N, C, H, W) batch,
+        from the same forward pass torchvision's EfficientNet.forward runs.
+        """
+        self.model.eval()
+        with torch.no_grad():
+            embeddings = torch.flatten(self.model.avgpool(self.model.features(images.to(self.device))), 1)
+            logits = self.model.classifier(embeddings)
+        return logits.cpu(), embeddings.cpu()
+
+    def grad_cam(self, images: torch.Tensor, target_classes: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Logits and Grad-CAM maps for a preprocessed (N, C, H, W) batch, from a single forward pass.
+
+        The backbone up to target_layer runs without autograd; only the head is differentiated, with one
+        backward over the summed target logits (samples are independent in eval mode). Maps are returned
+        at target_layer resolution as (N, h, w) CPU tensors scaled to [0, 1]. target_classes defaults
+        to the predicted class of each image.
+        """
+        self.model.eval()
+        with torch.no_grad():
+            activations = self.target_layer(self.model.features[:-1](images.to(self.device)))
+        activations.requires_grad_()
+
+        with torch.enable_grad():
+            logits = self.model.classifier(torch.flatten(self.model.avgpool(activations), 1))
+            if target_classes is None:
+                target_classes = logits.argmax(dim=1)
+            score = logits.gather(1, target_classes.to(logits.device).view(-1, 1)).sum()
+            (gradients,) = torch.autograd.grad(score, activations)
+
+        weights = gradients.mean(dim=(2, 3), keepdim=True)
+        cams = torch.relu((weights * activations.detach()).sum(dim=1))
+        cams = cams / cams.amax(dim=(1, 2), keepdim=True).clamp_min(1e-8)
+        return logits.detach().cpu(), cams.cpu()
+
+def load_model(checkpoint_path: str, backend: str = INFERENCE_BACKEND, precision: str = MODEL_PRECISION) -> BaseModel:
+    """
+    Build the serving model for a checkpoint with the configured execution backend.
+    "torch" runs the eager torchvision model; "onnx" runs ONNX Runtime on the graph exported next to the
+    checkpoint (exported on first use if it does not exist yet), optionally its approved INT8 variant.
+    """
+    if precision not in ("fp32", "int8"):
+        raise ValueError(f"Model precision '{precision}' is not supported.")
+    if precision == "int8" and backend != "onnx":
+        raise ValueError("INT8 precision requires the 'onnx' inference backend.")
+
+    if backend == "torch":
+        return EfficientNetModel.load_from_checkpoint(checkpoint_path)
+
+    if backend == "onnx":
+        from app.core.onnx_model import OnnxEfficientNetModel, export_onnx
+
+        onnx_path = os.path.splitext(checkpoint_path)[0] + ".onnx"
+        if not os.path.exists(onnx_path):
+            print(f"[Model] ONNX graph not found at {onnx_path}, exporting from checkpoint...")
+            export_onnx(checkpoint_path, onnx_path)
+
+        if precision == "int8":
+            from app.core.quantization import load_approved_int8
+            return load_approved_int8(onnx_path)
+        return OnnxEfficientNetModel.load_from_onnx(onnx_path)
+
+    raise ValueError(f"Inference backend '{backend}' is not supported.")
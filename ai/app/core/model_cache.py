@@ -0,0 +1,68 @@
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+from app.core.config import GOOGLE_CLOUD_RUN, MODEL_BUCKET, MODEL_BUCKET_PREFIX, MODEL_PATH, MODEL_SHA256
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _cached_hash(path: str) -> Optional[str]:
+    try:
+        with open(f"{path}.sha256") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def _is_valid(path: str, expected_sha256: Optional[str]) -> bool:
+    if not os.path.exists(path):
+        return False
+    expected = expected_sha256 or _cached_hash(path)
+    if expected is None:
+        # Local development checkpoints without a pinned hash or sidecar are trusted as-is
+        return not GOOGLE_CLOUD_RUN
+    return sha256_file(path) == expected
+
+def _download(name: str, path: str, expected_sha256: Optional[str]):
+    from google.cloud import storage
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    os.close(fd)
+    try:
+        storage.Client().bucket(MODEL_BUCKET).blob(f"{MODEL_BUCKET_PREFIX}/{name}").download_to_filename(tmp_path)
+        actual = sha256_file(tmp_path)
+        if expected_sha256 and actual != expected_sha256:
+            raise ValueError(f"Checksum mismatch for {name}: expected {expected_sha256}, got {actual}")
+        os.replace(tmp_path, path)
+        with open(f"{path}.sha256", "w") as f:
+            f.write(actual)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def ensure_model_artifact(name: str, cache_dir: str = MODEL_PATH, expected_sha256: Optional[str] = MODEL_SHA256) -> str:
+    """
+    Return the local path of a checkpoint, downloading it only when the cached copy is missing or fails
+    its SHA-256 check. The hash comes from MODEL_SHA256 when pinned, otherwise from the sidecar written at
+    download time, so a baked or mounted cache directory starts without any network access.
+    """
+    path = os.path.join(cache_dir, name)
+    if _is_valid(path, expected_sha256):
+        print(f"[ModelCache] Using cached model {path}")
+        return path
+
+    if not GOOGLE_CLOUD_RUN:
+        raise FileNotFoundError(f"Model {path} is missing or does not match its checksum.")
+
+    print(f"[ModelCache] Downloading model {name} from gs://{MODEL_BUCKET}/{MODEL_BUCKET_PREFIX}...")
+    try:
+        _download(name, path, expected_sha256)
+    except Exception as e:
+        raise Exception(f"Error downloading model: {e}")
+    return path
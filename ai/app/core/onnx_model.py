@@ -0,0 +1,160 @@
+import json
+import numpy as np
+import onnx
+import onnxruntime as ort
+import os
+from pathlib import Path
+import torch
+from typing import Dict, Tuple
+
+from app.core.model import EfficientNetModel
+
+# Checkpoint fields carried into the ONNX graph so it can be served without the .pth file
+METADATA_KEYS = ("num_classes", "model_version", "model_dataset", "model_name")
+
+class _WithEmbeddings(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        embeddings = torch.flatten(self.model.avgpool(self.model.features(images)), 1)
+        return self.model.classifier(embeddings), embeddings
+
+def export_onnx(checkpoint_path: str, output_path: str, opset: int = 17) -> str:
+    """
+    Export a .pth checkpoint (loaded through EfficientNetModel.load_from_checkpoint) to an ONNX graph
+    with a dynamic batch dimension. The graph outputs the logits and the pooled features they come from.
+    """
+    model = EfficientNetModel.load_from_checkpoint(checkpoint_path)
+    model.model.eval()
+
+    dummy = torch.zeros(1, 3, model.input_size, model.input_size, device=model.device)
+    torch.onnx.export(
+        _WithEmbeddings(model.model),
+        dummy,
+        output_path,
+        input_names=["input"],
+        output_names=["logits", "embeddings"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}, "embeddings": {0: "batch"}},
+        opset_version=opset
+    )
+
+    graph = onnx.load(output_path)
+    metadata = {
+        "num_classes": model.num_classes,
+        "model_version": model.version,
+        "model_dataset": model.dataset,
+        "model_name": model.model_name,
+    }
+    for key in METADATA_KEYS:
+        entry = graph.metadata_props.add()
+        entry.key = key
+        entry.value = json.dumps(metadata[key])
+    onnx.save(graph, output_path)
+
+    print(f"[ONNX] Exported {checkpoint_path} to {output_path}")
+    return output_path
+
+class OnnxEfficientNetModel(EfficientNetModel):
+    """
+    EfficientNet served by ONNX Runtime behind the same predict_batch / forward_logits interface.
+    Preprocessing pipelines are rebuilt from the torchvision metadata, so no torch weights are loaded.
+    """
+
+    def __init__(self, session: ort.InferenceSession, onnx_path: str, **kwargs):
+        self.session = session
+        self.onnx_path = onnx_path
+        super().__init__(pretrained=False, **kwargs)
+
+    @classmethod
+    def load_from_onnx(cls, path: str, intra_op_threads: int = 0):
+        """Factory method to create model from an ONNX graph written by export_onnx (0 threads = ORT default)"""
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+        metadata = session.get_modelmeta().custom_metadata_map
+        metadata = {key: json.loads(metadata[key]) for key in METADATA_KEYS}
+        return cls(
+            session=session,
+            onnx_path=path,
+            num_classes=metadata["num_classes"],
+            version=metadata["model_version"],
+            dataset=metadata["model_dataset"],
+            model_name=metadata["model_name"]
+        )
+
+    def _load_model(self, model_fn):
+        return self.session
+
+    def _get_last_conv_layer(self):
+        return None
+
+    def memory_bytes(self) -> int:
+        return os.path.getsize(self.onnx_path)
+
+    def forward_logits(self, images: torch.Tensor) -> torch.Tensor:
+        inputs = np.ascontiguousarray(images.cpu().numpy(), dtype=np.float32)
+        outputs = self.model.run(["logits"], {"input": inputs})[0]
+        return torch.from_numpy(outputs)
+
+    @property
+    def supports_embeddings(self) -> bool:
+        # Graphs exported before the embeddings output was added only return logits
+        return "embeddings" in [output.name for output in self.model.get_outputs()]
+
+    def forward_embeddings(self, images: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        if not self.supports_embeddings:
+            raise NotImplementedError(f"{self.onnx_path} has no embeddings output; re-export it with export_onnx.")
+        inputs = np.ascontiguousarray(images.cpu().numpy(), dtype=np.float32)
+        logits, embeddings = self.model.run(["logits", "embeddings"], {"input": inputs})
+        return torch.from_numpy(logits), torch.from_numpy(embeddings)
+
+def verify_onnx(checkpoint_path: str, onnx_path: str, images: torch.Tensor) -> Dict[str, float]:
+    """Compare ONNX Runtime logits and labels against the PyTorch checkpoint on the same preprocessed batch"""
+    reference = EfficientNetModel.load_from_checkpoint(checkpoint_path)
+    candidate = OnnxEfficientNetModel.load_from_onnx(onnx_path)
+
+    reference_logits = reference.forward_logits(images)
+    candidate_logits = candidate.forward_logits(images)
+    reference_predictions = reference.decode_predictions(reference_logits)
+    candidate_predictions = candidate.decode_predictions(candidate_logits)
+    agreement = sum(a == b for a, b in zip(reference_predictions, candidate_predictions)) / len(images)
+
+    return {
+        "images": len(images),
+        "max_abs_logit_diff": (reference_logits - candidate_logits).abs().max().item(),
+        "prediction_agreement": agreement,
+    }
+
+def _load_images(model, images_dir: str, count: int) -> torch.Tensor:
+    if images_dir is None:
+        return torch.randn(count, 3, model.input_size, model.input_size)
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if not paths:
+        raise SystemExit(f"No images found in {images_dir}")
+    return model.tensor_preprocess.preprocess_buffers([p.read_bytes() for p in paths])
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export a checkpoint to ONNX and verify it against PyTorch")
+    parser.add_argument("checkpoint", help="Path to the .pth checkpoint")
+    parser.add_argument("--output", help="ONNX output path (default: checkpoint path with .onnx suffix)")
+    parser.add_argument("--images", help="Folder of sample images for verification (default: random tensors)")
+    parser.add_argument("--count", type=int, default=9, help="Random tensors to verify with when --images is not given")
+    parser.add_argument("--skip-export", action="store_true", help="Only verify an existing ONNX graph")
+    args = parser.parse_args()
+
+    output = args.output or str(Path(args.checkpoint).with_suffix(".onnx"))
+    if not args.skip_export:
+        export_onnx(args.checkpoint, output)
+
+    model = OnnxEfficientNetModel.load_from_onnx(output)
+    images = _load_images(model, args.images, args.count)
+    print(json.dumps(verify_onnx(args.checkpoint, output, images)))
+
+if __name__ == "__main__":
+    main()
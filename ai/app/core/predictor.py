@@ -0,0 +1,155 @@
+import asyncio
+import torch
+from typing import Any, AsyncIterator, Dict, Hashable, List, Tuple, Union
+
+from app.core import tta as test_time_augmentation
+from app.core.cache import PredictionCache, prediction_cache
+from app.core.config import PIPELINE_CHUNK_SIZE, PIPELINE_DEPTH, TTA_VARIANTS
+from app.core.executor import executor
+from app.core.metrics import CACHE_LOOKUPS
+from app.core.preprocessing import decode_and_preprocess
+
+async def _forward(entry, batch: torch.Tensor, tta: bool, embeddings: bool = False) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+    if embeddings:
+        return await entry.batcher.submit(batch, embeddings=True)
+    if not tta:
+        return await entry.batcher.submit(batch)
+    # All variants go through the batcher as one stacked batch, then get averaged per image
+    logits = await entry.batcher.submit(test_time_augmentation.expand(batch, TTA_VARIANTS))
+    return test_time_augmentation.reduce(logits, len(TTA_VARIANTS))
+
+async def _compute(
+    entry,
+    image_buffers: List[Union[bytes, memoryview]],
+    tta: bool,
+    chunk_size: int = PIPELINE_CHUNK_SIZE,
+    depth: int = PIPELINE_DEPTH,
+    embeddings: bool = False
+) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+    if chunk_size <= 0 or len(image_buffers) <= chunk_size:
+        batch = await executor.run(decode_and_preprocess, entry.model, image_buffers)
+        return await _forward(entry, batch, tta, embeddings)
+
+    # Pipelined: micro-batch k+1 is decoded and preprocessed while micro-batch k is in the forward pass, and
+    # only `depth` micro-batches of decoded images exist at once instead of the whole request
+    slots = asyncio.Semaphore(depth)
+
+    async def run_chunk(chunk: List[Union[bytes, memoryview]]) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        async with slots:
+            batch = await executor.run(decode_and_preprocess, entry.model, chunk)
+            return await _forward(entry, batch, tta, embeddings)
+
+    tasks = [asyncio.ensure_future(run_chunk(image_buffers[start:start + chunk_size])) for start in range(0, len(image_buffers), chunk_size)]
+    try:
+        results = await asyncio.gather(*tasks)
+        if embeddings:
+            return torch.cat([logits for logits, _ in results]), torch.cat([features for _, features in results])
+        return torch.cat(results)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+def _keys(model_version: str, image_buffers: List[Union[bytes, memoryview]], variant: str) -> List[Hashable]:
+    return [PredictionCache.key(model_version, buffer, variant) for buffer in image_buffers]
+
+async def predict_logits(entry, image_buffers: List[Union[bytes, memoryview]], tta: bool = False, cache: PredictionCache = prediction_cache) -> torch.Tensor:
+    """
+    Logits for each encoded image, in request order, for the given registry entry.
+
+    Images already in the prediction cache cost a hash lookup; images another request is computing right
+    now are awaited rather than recomputed; only the rest are decoded and sent through the batcher.
+    With tta the logits are averaged over TTA_VARIANTS and cached separately from plain predictions.
+    Raises ValueError when an image cannot be decoded.
+    """
+    if not cache.enabled:
+        return await _compute(entry, image_buffers, tta)
+
+    variant = "tta:" + ",".join(TTA_VARIANTS) if tta else ""
+    keys = await executor.run(_keys, entry.version, image_buffers, variant)
+    results: List[torch.Tensor] = [None] * len(image_buffers)
+    owned: Dict[Hashable, int] = {} # images this request computes, by first index
+    duplicates: List[Tuple[int, Hashable]] = []
+    waiting: Dict[int, asyncio.Future] = {}
+
+    for idx, key in enumerate(keys):
+        logits = cache.get(key)
+        if logits is not None:
+            cache.hits += 1
+            CACHE_LOOKUPS.labels("hit").inc()
+            results[idx] = logits
+        elif key in owned:
+            duplicates.append((idx, key))
+        elif cache.inflight(key) is not None:
+            cache.coalesced += 1
+            CACHE_LOOKUPS.labels("coalesced").inc()
+            waiting[idx] = cache.inflight(key)
+        else:
+            cache.misses += 1
+            CACHE_LOOKUPS.labels("miss").inc()
+            cache.claim(key)
+            owned[key] = idx
+
+    if owned:
+        try:
+            computed = await _compute(entry, [image_buffers[idx] for idx in owned.values()], tta)
+        except BaseException:
+            for key in owned:
+                cache.release(key)
+            raise
+        for (key, idx), logits in zip(owned.items(), computed):
+            results[idx] = logits.clone()
+            cache.resolve(key, results[idx])
+
+    for idx, key in duplicates:
+        results[idx] = results[owned[key]]
+
+    retry = []
+    for idx, future in waiting.items():
+        # shield: a cancelled waiter must not cancel the computation other requests are waiting on
+        logits = await asyncio.shield(future)
+        if logits is None:
+            retry.append(idx)
+        else:
+            results[idx] = logits
+    if retry:
+        computed = await _compute(entry, [image_buffers[idx] for idx in retry], tta)
+        for idx, logits in zip(retry, computed):
+            results[idx] = logits
+
+    return torch.stack(results)
+
+async def predict_embeddings(entry, image_buffers: List[Union[bytes, memoryview]]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    (logits, embeddings) for each encoded image, in request order, from one pass through the shared batcher.
+    Embeddings are not cached, so this always runs the forward pass. Raises ValueError when an image cannot
+    be decoded and NotImplementedError when the model does not expose embeddings.
+    """
+    if not entry.model.supports_embeddings:
+        # Checked before queueing, so the request never joins a forward pass it cannot run
+        raise NotImplementedError(f"Model version '{entry.version}' does not expose embeddings; re-export its ONNX graph with export_onnx.")
+    return await _compute(entry, image_buffers, tta=False, embeddings=True)
+
+async def _predict_case(entry, case_id: str, image_buffers: List[Union[bytes, memoryview]], tta: bool) -> Dict[str, Any]:
+    try:
+        logits = await predict_logits(entry, image_buffers, tta=tta)
+        return {"case_id": case_id, "status": "ok", "predictions": entry.model.decode_predictions(logits)}
+    except ValueError as e:
+        # Undecodable images fail the same way every time
+        return {"case_id": case_id, "status": "error", "error": str(e), "retryable": False}
+    except Exception as e:
+        return {"case_id": case_id, "status": "error", "error": str(e), "retryable": True}
+
+async def predict_cases(entry, cases: List[Tuple[str, List[Union[bytes, memoryview]]]], tta: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Per-case results in completion order. Every case is predicted concurrently through the shared batcher,
+    so cases still share forward passes, but each one succeeds or fails on its own. Closing the generator early
+    (e.g. the client disconnected) cancels the cases not yet finished.
+    """
+    tasks = [asyncio.ensure_future(_predict_case(entry, case_id, image_buffers, tta)) for case_id, image_buffers in cases]
+    try:
+        for result in asyncio.as_completed(tasks):
+            yield await result
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,133 @@
+from io import BytesIO
+import numpy as np
+from PIL import Image
+import torch
+import torch.nn.functional as F
+from typing import Dict, List, Tuple, Union
+
+from app.core.config import PREPROCESS_MODE
+from app.core.dataloader import InferenceDataset
+from app.core.metrics import STAGE_SECONDS
+
+class TensorPreprocessor:
+    """
+    Batched alternative to the albumentations Resize(INTER_CUBIC) + Normalize + ToTensorV2 pipeline.
+
+    JPEGs are decoded with PIL's draft mode, which lets libjpeg scale by 1/2, 1/4 or 1/8 in the DCT
+    domain while staying at or above the model input size, so full-resolution phone photos are never
+    materialised. Decoded images are stacked per shape and resized and normalized as whole batches.
+    """
+
+    # Upper bound on float32 elements resized in one interpolate call (~256 MB)
+    MAX_RESIZE_ELEMENTS = 64 * 1024 * 1024
+
+    def __init__(self, input_size: int, mean, std, draft: bool = True):
+        self.input_size = input_size
+        self.draft = draft
+        # Same arithmetic as A.Normalize(max_pixel_value=255): (x - mean * 255) / (std * 255)
+        self.mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1) * 255.0
+        self.std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1) * 255.0
+
+    def decode(self, buffer: Union[bytes, memoryview]) -> np.ndarray:
+        img = Image.open(BytesIO(buffer))
+        if self.draft:
+            img.draft("RGB", (self.input_size, self.input_size))
+        return np.asarray(img.convert("RGB"))
+
+    def __call__(self, images: List[np.ndarray]) -> torch.Tensor:
+        """Resize and normalize a list of HWC uint8 arrays into one (N, C, H, W) float tensor"""
+        batch = torch.empty((len(images), 3, self.input_size, self.input_size), dtype=torch.float32)
+
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for idx, image in enumerate(images):
+            groups.setdefault(image.shape[:2], []).append(idx)
+
+        for (height, width), indices in groups.items():
+            chunk_size = max(1, self.MAX_RESIZE_ELEMENTS // (height * width * 3))
+            for start in range(0, len(indices), chunk_size):
+                chunk = indices[start:start + chunk_size]
+                stacked = torch.from_numpy(np.stack([images[i] for i in chunk])).permute(0, 3, 1, 2).float()
+                resized = F.interpolate(
+                    stacked,
+                    size=(self.input_size, self.input_size),
+                    mode="bicubic",
+                    align_corners=False,
+                    antialias=False
+                )
+                # cv2 saturates the resized image back to uint8 before Normalize runs
+                batch[chunk] = resized.round_().clamp_(0, 255)
+
+        return batch.sub_(self.mean).div_(self.std)
+
+    def preprocess_buffers(self, buffers: List[Union[bytes, memoryview]]) -> torch.Tensor:
+        return self([self.decode(buffer) for buffer in buffers])
+
+def decode_and_preprocess(model, image_buffers: List[Union[bytes, memoryview]], mode: str = PREPROCESS_MODE) -> torch.Tensor:
+    """Decode encoded images and build the (N, C, H, W) model input with the configured preprocessing mode"""
+    images = []
+    with STAGE_SECONDS.labels("decode").time():
+        for buffer in image_buffers:
+            try:
+                if mode == "tensor":
+                    img = model.tensor_preprocess.decode(buffer)
+                else:
+                    img = Image.open(BytesIO(buffer)).convert("RGB")
+                images.append(img)
+            except Exception as e:
+                raise ValueError(f"Image decoding failed: {e}")
+
+    with STAGE_SECONDS.labels("preprocess").time():
+        if mode == "tensor":
+            return model.tensor_preprocess(images)
+
+        dataset = InferenceDataset(images, transform=model.preprocess)
+        return torch.stack([dataset[i] for i in range(len(dataset))])
+
+def check_parity(model, buffers: List[bytes], draft: bool = True) -> Dict[str, float]:
+    """
+    Compare TensorPreprocessor against the model's albumentations pipeline on the same JPEG bytes.
+    Reports tensor differences and how often the resulting predictions agree.
+    """
+    reference = torch.stack([
+        model.preprocess(image=np.array(Image.open(BytesIO(buffer)).convert("RGB")))["image"]
+        for buffer in buffers
+    ])
+    preprocessor = TensorPreprocessor(model.input_size, model.mean, model.std, draft=draft)
+    candidate = preprocessor.preprocess_buffers(buffers)
+
+    diff = (reference - candidate).abs()
+    reference_predictions = model.decode_predictions(model.forward_logits(reference))
+    candidate_predictions = model.decode_predictions(model.forward_logits(candidate))
+    agreement = sum(a == b for a, b in zip(reference_predictions, candidate_predictions)) / len(buffers)
+
+    return {
+        "images": len(buffers),
+        "draft": draft,
+        "max_abs_diff": diff.max().item(),
+        "mean_abs_diff": diff.mean().item(),
+        "prediction_agreement": agreement,
+    }
+
+def main():
+    import argparse
+    import json
+    from pathlib import Path
+
+    from app.core.config import MODEL, MODEL_PATH
+    from app.core.model import EfficientNetModel
+
+    parser = argparse.ArgumentParser(description="Parity check between tensor and albumentations preprocessing")
+    parser.add_argument("images_dir", help="Folder of sample JPEGs")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in Path(args.images_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if not paths:
+        raise SystemExit(f"No images found in {args.images_dir}")
+    buffers = [p.read_bytes() for p in paths]
+
+    model = EfficientNetModel.load_from_checkpoint(f"{MODEL_PATH}/{MODEL}")
+    for draft in (False, True):
+        print(json.dumps(check_parity(model, buffers, draft=draft)))
+
+if __name__ == "__main__":
+    main()
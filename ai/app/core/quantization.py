@@ -0,0 +1,176 @@
+import json
+import numpy as np
+import onnx
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quant_pre_process, quantize_static
+import os
+from pathlib import Path
+from PIL import Image
+import statistics
+import tempfile
+import time
+import torch
+from typing import Dict, Iterator, List, Optional
+
+from app.core.config import QUANTIZATION_MIN_AGREEMENT
+from app.core.onnx_model import OnnxEfficientNetModel
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+def int8_paths(onnx_path: str):
+    """Return the (INT8 graph, parity report) paths that sit next to an FP32 ONNX graph"""
+    stem = os.path.splitext(onnx_path)[0]
+    return f"{stem}.int8.onnx", f"{stem}.int8.report.json"
+
+def _image_paths(images_dir: str) -> List[Path]:
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    if not paths:
+        raise ValueError(f"No images found in {images_dir}")
+    return paths
+
+def _preprocessed_batches(model, paths: List[Path], batch_size: int) -> Iterator[np.ndarray]:
+    # Calibrate and evaluate on the reference albumentations pipeline, which is what serving defaults to
+    for start in range(0, len(paths), batch_size):
+        batch = []
+        for path in paths[start:start + batch_size]:
+            image = np.array(Image.open(path).convert("RGB"))
+            batch.append(model.preprocess(image=image)["image"])
+        yield torch.stack(batch).numpy()
+
+class ImageFolderCalibrationReader(CalibrationDataReader):
+    """Feeds preprocessed batches from a folder of representative oral-cavity images to the calibrator"""
+
+    def __init__(self, model, images_dir: str, batch_size: int = 9):
+        self._batches = _preprocessed_batches(model, _image_paths(images_dir), batch_size)
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        batch = next(self._batches, None)
+        return None if batch is None else {"input": batch}
+
+def quantize_onnx(onnx_path: str, calibration_dir: str, output_path: str) -> str:
+    """
+    Post-training static INT8 quantization (QDQ, per-channel weights) of an FP32 graph from export_onnx.
+    Activation ranges are calibrated on the images in calibration_dir.
+    """
+    model = OnnxEfficientNetModel.load_from_onnx(onnx_path)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        prepared_path = os.path.join(tmpdir, "prepared.onnx")
+        quant_pre_process(onnx_path, prepared_path)
+        quantize_static(
+            prepared_path,
+            output_path,
+            calibration_data_reader=ImageFolderCalibrationReader(model, calibration_dir),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax
+        )
+
+    # Carry the checkpoint metadata over so the INT8 graph loads through load_from_onnx
+    source = onnx.load(onnx_path, load_external_data=False)
+    quantized = onnx.load(output_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, output_path)
+
+    print(f"[Quantization] Wrote INT8 graph to {output_path}")
+    return output_path
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def _load_measured(path: str):
+    before = _rss_bytes()
+    model = OnnxEfficientNetModel.load_from_onnx(path)
+    return model, _rss_bytes() - before
+
+def _median_latency_ms(model, batch: np.ndarray, repeats: int) -> float:
+    inputs = torch.from_numpy(batch)
+    model.forward_logits(inputs) # warmup
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.forward_logits(inputs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def evaluate_int8(fp32_path: str, int8_path: str, images_dir: str, batch_size: int = 9, repeats: int = 10) -> Dict:
+    """
+    Parity harness for the INT8 variant: label agreement with FP32 on a folder of images, median latency
+    per batch_size-image batch, resident memory added by loading each model and graph size on disk.
+    """
+    fp32, fp32_rss = _load_measured(fp32_path)
+    int8, int8_rss = _load_measured(int8_path)
+
+    total = agreed = 0
+    per_class: Dict[str, List[int]] = {}
+    first_batch = None
+    for batch in _preprocessed_batches(fp32, _image_paths(images_dir), batch_size):
+        if first_batch is None:
+            first_batch = batch
+        inputs = torch.from_numpy(batch)
+        fp32_predictions = fp32.decode_predictions(fp32.forward_logits(inputs))
+        int8_predictions = int8.decode_predictions(int8.forward_logits(inputs))
+        for expected, actual in zip(fp32_predictions, int8_predictions):
+            counts = per_class.setdefault(expected, [0, 0])
+            counts[0] += expected == actual
+            counts[1] += 1
+            agreed += expected == actual
+            total += 1
+
+    fp32_latency = _median_latency_ms(fp32, first_batch, repeats)
+    int8_latency = _median_latency_ms(int8, first_batch, repeats)
+
+    return {
+        "images": total,
+        "agreement": agreed / total,
+        "agreement_by_fp32_label": {label: hits / count for label, (hits, count) in per_class.items()},
+        "latency_ms": {"batch_size": len(first_batch), "fp32": fp32_latency, "int8": int8_latency, "speedup": fp32_latency / int8_latency},
+        "memory_bytes": {"fp32_rss": fp32_rss, "int8_rss": int8_rss, "fp32_file": os.path.getsize(fp32_path), "int8_file": os.path.getsize(int8_path)},
+    }
+
+def load_approved_int8(onnx_path: str, min_agreement: float = QUANTIZATION_MIN_AGREEMENT):
+    """Load the INT8 graph for onnx_path, refusing to serve it without a passing parity report"""
+    int8_path, report_path = int8_paths(onnx_path)
+    if not os.path.exists(int8_path) or not os.path.exists(report_path):
+        raise FileNotFoundError(f"INT8 model or parity report missing for {onnx_path}. Run `python -m app.core.quantization` first.")
+
+    with open(report_path) as f:
+        report = json.load(f)
+    if report["agreement"] < min_agreement:
+        raise ValueError(f"INT8 model agreement {report['agreement']:.4f} is below the required {min_agreement:.4f}.")
+
+    print(f"[Quantization] Serving INT8 model {int8_path} (agreement {report['agreement']:.4f}, speedup {report['latency_ms']['speedup']:.2f}x)")
+    return OnnxEfficientNetModel.load_from_onnx(int8_path)
+
+def main():
+    import argparse
+
+    from app.core.onnx_model import export_onnx
+
+    parser = argparse.ArgumentParser(description="Quantize a checkpoint to INT8 and report parity with FP32")
+    parser.add_argument("checkpoint", help="Path to the .pth checkpoint")
+    parser.add_argument("--calibration", required=True, help="Folder of representative images for calibration")
+    parser.add_argument("--evaluation", help="Folder of held-out images for the parity report (default: calibration folder)")
+    parser.add_argument("--batch-size", type=int, default=9)
+    args = parser.parse_args()
+
+    onnx_path = os.path.splitext(args.checkpoint)[0] + ".onnx"
+    if not os.path.exists(onnx_path):
+        export_onnx(args.checkpoint, onnx_path)
+
+    int8_path, report_path = int8_paths(onnx_path)
+    quantize_onnx(onnx_path, args.calibration, int8_path)
+
+    report = evaluate_int8(onnx_path, int8_path, args.evaluation or args.calibration, batch_size=args.batch_size)
+    report["approved"] = report["agreement"] >= QUANTIZATION_MIN_AGREEMENT
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+    print(f"[Quantization] Report written to {report_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+from collections import OrderedDict
+import json
+import os
+from threading import Event, RLock, Thread
+import time
+import torch
+from typing import Any, Dict, Optional
+
+from app.core.autotune import autotune
+from app.core.batcher import BatchScheduler
+from app.core.config import AUTOTUNE_ON_STARTUP, AUTOTUNE_SHARED_WAIT_SECONDS, BATCH_MAX_SIZE, MODEL_MEMORY_BUDGET_MB
+from app.core.executor import executor
+from app.core.model import load_model
+from app.core.model_cache import ensure_model_artifact
+from app.core.preprocessing import decode_and_preprocess
+from app.core.warmup import run_warmup
+
+class ModelEntry:
+    def __init__(self, version: str, model, batcher: BatchScheduler):
+        self.version = version
+        self.model = model
+        self.batcher = batcher
+        self.memory_bytes = model.memory_bytes()
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+
+class ModelRegistry:
+    """
+    Holds every loaded checkpoint, keyed by its file name (the model version).
+
+    New versions are loaded and warmed up on a background thread and only become visible once ready,
+    so swapping the default is a single reference update. Non-default models are evicted least recently
+    used first whenever the loaded weights exceed the memory budget. Requests that already hold an
+    entry keep it alive until they finish.
+    """
+
+    def __init__(self, executor, memory_budget_bytes: int = MODEL_MEMORY_BUDGET_MB * 1024 * 1024):
+        self.executor = executor
+        self.memory_budget_bytes = memory_budget_bytes
+        self.ready = Event()
+        self._entries: "OrderedDict[str, ModelEntry]" = OrderedDict() # least recently used first
+        self._default: Optional[str] = None
+        self._loading: Dict[str, Thread] = {}
+        self._errors: Dict[str, str] = {}
+        self._preloaded: Dict[str, Any] = {}
+        self.max_batch_size = BATCH_MAX_SIZE
+        self.autotune_report: Optional[Dict[str, Any]] = None
+        self._autotune_path: Optional[str] = None # Report shared by app.serve workers
+        self._autotune_leader = True
+        self._lock = RLock()
+
+    @property
+    def default_version(self) -> Optional[str]:
+        return self._default
+
+    def load_error(self, version: str) -> Optional[str]:
+        return self._errors.get(version)
+
+    def preload(self, version: str, model):
+        """Use an already loaded model (e.g. weights shared by a pre-fork parent) the next time version is loaded"""
+        self._preloaded[version] = model
+
+    def share_autotune(self, path: str, leader: bool):
+        """
+        Share startup autotuning between pre-forked workers: the leader benchmarks and writes its report to path,
+        the others apply that report instead of benchmarking the same CPUs at the same time.
+        """
+        self._autotune_path = path
+        self._autotune_leader = leader
+
+    def load(self, version: str, make_default: bool = False, background: bool = True):
+        """Load (or re-point the default to) a checkpoint; returns immediately when background is True"""
+        with self._lock:
+            if version in self._entries:
+                if make_default:
+                    self.set_default(version)
+                return
+            if version in self._loading:
+                return
+            thread = Thread(target=self._load, args=(version, make_default), name=f"model-loader-{version}", daemon=True)
+            self._loading[version] = thread
+            self._errors.pop(version, None)
+
+        thread.start()
+        if not background:
+            thread.join()
+
+    def _load(self, version: str, make_default: bool):
+        try:
+            model = self._preloaded.pop(version, None)
+            if model is None:
+                model = load_model(ensure_model_artifact(version))
+            # Tune on the first default model while the instance is not taking traffic yet
+            tune = AUTOTUNE_ON_STARTUP and self.autotune_report is None and (make_default or self._default is None)
+            if tune and self._autotune_path is not None and (not self._autotune_leader or os.path.exists(self._autotune_path)):
+                # Followers (and a restarted leader) adopt the shared report, waiting for it before their warmup
+                self._adopt_autotune(self._autotune_path)
+                tune = False
+            run_warmup(lambda buffers: model.forward_logits(decode_and_preprocess(model, buffers)))
+            if tune:
+                self.autotune(model)
+            entry = ModelEntry(version, model, BatchScheduler(model, executor=self.executor, max_batch_size=self.max_batch_size))
+
+            with self._lock:
+                self._entries[version] = entry
+                if make_default or self._default is None:
+                    self._default = version
+                    self.ready.set()
+                self._evict()
+                if version not in self._entries:
+                    raise MemoryError(f"{entry.memory_bytes} bytes do not fit in the model memory budget.")
+            print(f"[ModelRegistry] Model {version} loaded and warmed up ({entry.memory_bytes / 2**20:.1f} MB).")
+        except Exception as e:
+            self._errors[version] = str(e)
+            print(f"[ModelRegistry] Failed to load model {version}: {e}")
+        finally:
+            with self._lock:
+                self._loading.pop(version, None)
+
+    def get(self, version: Optional[str] = None) -> ModelEntry:
+        """Return the requested model, or the default one when version is None"""
+        with self._lock:
+            version = version or self._default
+            entry = self._entries.get(version) if version else None
+            if entry is None:
+                raise KeyError(version)
+            entry.last_used = time.time()
+            self._entries.move_to_end(version)
+            return entry
+
+    def set_default(self, version: str):
+        with self._lock:
+            if version not in self._entries:
+                raise KeyError(version)
+            self._default = version
+            self.ready.set()
+        print(f"[ModelRegistry] Default model is now {version}.")
+
+    def unload(self, version: str):
+        with self._lock:
+            if version == self._default:
+                raise ValueError("Cannot unload the default model.")
+            entry = self._entries.pop(version, None)
+            if entry is None:
+                raise KeyError(version)
+        entry.batcher.close()
+        print(f"[ModelRegistry] Unloaded model {version}.")
+
+    def _evict(self):
+        total = sum(entry.memory_bytes for entry in self._entries.values())
+        for version in list(self._entries):
+            if total <= self.memory_budget_bytes:
+                break
+            if version == self._default:
+                continue
+            entry = self._entries.pop(version)
+            entry.batcher.close()
+            total -= entry.memory_bytes
+            print(f"[ModelRegistry] Evicted idle model {version} to stay within the memory budget.")
+
+    def autotune(self, model=None, **kwargs) -> Dict[str, Any]:
+        """Benchmark thread counts and batch sizes on model (the default one if None) and apply the best"""
+        report = autotune(model or self.get().model, **kwargs)
+        self._apply_autotune(report)
+        if self._autotune_path is not None and self._autotune_leader:
+            with open(self._autotune_path + ".tmp", "w") as f:
+                json.dump(report, f)
+            os.replace(self._autotune_path + ".tmp", self._autotune_path)
+        return report
+
+    def _apply_autotune(self, report: Dict[str, Any]):
+        with self._lock:
+            self.max_batch_size = report["batch_size"]
+            for entry in self._entries.values():
+                entry.batcher.max_batch_size = report["batch_size"]
+            self.autotune_report = report
+
+    def _adopt_autotune(self, path: str, wait_seconds: float = AUTOTUNE_SHARED_WAIT_SECONDS):
+        deadline = time.monotonic() + wait_seconds
+        while not os.path.exists(path):
+            if time.monotonic() >= deadline:
+                print(f"[ModelRegistry] No shared autotune report after {wait_seconds:.0f}s, keeping the defaults.")
+                return
+            time.sleep(0.5)
+        with open(path) as f:
+            report = json.load(f)
+        torch.set_num_threads(report["threads"])
+        self._apply_autotune(report)
+        print(f"[ModelRegistry] Applied the shared autotune report: {report['threads']} threads, batch size {report['batch_size']}.")
+
+    def queued_images(self) -> int:
+        with self._lock:
+            return sum(entry.batcher.queued_images for entry in self._entries.values())
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "default": self._default,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "loaded": [
+                    {
+                        "version": entry.version,
+                        "memory_bytes": entry.memory_bytes,
+                        "loaded_at": entry.loaded_at,
+                        "last_used": entry.last_used,
+                    }
+                    for entry in reversed(self._entries.values())
+                ],
+                "loading": list(self._loading),
+                "errors": dict(self._errors),
+            }
+
+registry = ModelRegistry(executor)
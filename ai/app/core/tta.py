@@ -0,0 +1,26 @@
+import torch
+from typing import Callable, Dict, List
+
+from app.core.config import TTA_VARIANTS
+
+# Deterministic counterparts of the flips and 90-degree rotations in the training augmentation pipeline,
+# applied to (N, C, H, W) tensors. Model inputs are square, so rotations keep the shape.
+TTA_TRANSFORMS: Dict[str, Callable[[torch.Tensor], torch.Tensor]] = {
+    "identity": lambda images: images,
+    "hflip": lambda images: torch.flip(images, dims=(3,)),
+    "vflip": lambda images: torch.flip(images, dims=(2,)),
+    "rot90": lambda images: torch.rot90(images, 1, dims=(2, 3)),
+    "rot180": lambda images: torch.rot90(images, 2, dims=(2, 3)),
+    "rot270": lambda images: torch.rot90(images, 3, dims=(2, 3)),
+}
+
+def expand(images: torch.Tensor, variants: List[str] = TTA_VARIANTS) -> torch.Tensor:
+    """Stack every variant of an (N, C, H, W) batch into one (V * N, C, H, W) batch, variant-major"""
+    unknown = [variant for variant in variants if variant not in TTA_TRANSFORMS]
+    if unknown:
+        raise ValueError(f"Unknown TTA variants: {unknown}")
+    return torch.cat([TTA_TRANSFORMS[variant](images) for variant in variants])
+
+def reduce(logits: torch.Tensor, num_variants: int) -> torch.Tensor:
+    """Average (V * N, K) logits from expand() back to (N, K)"""
+    return logits.view(num_variants, -1, logits.shape[-1]).mean(dim=0)
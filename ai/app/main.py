@@ -1,11 +1,79 @@
 from fastapi import FastAPI, Request
-from app.api import inference
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
+import os
+import time
+from app.api import embeddings, inference, jobs, models
+from app.core.cache import prediction_cache
+from app.core.config import MODEL
+from app.core.executor import executor
+from app.core.metrics import CACHE_ENTRIES, INFLIGHT_REQUESTS, QUEUE_DEPTH, REQUEST_SECONDS
+from app.core.registry import registry
 
 app = FastAPI()
 
-app.include_router(inference.router, prefix="/inference")
+ROUTERS = {
+    "/inference": inference.router,
+    "/inference/jobs": jobs.router,
+    "/models": models.router,
+    "/embeddings": embeddings.router,
+}
+for prefix, router in ROUTERS.items():
+    app.include_router(router, prefix=prefix)
+# Full path template of each included route: newer FastAPI versions match the router's own route object,
+# whose path does not have the prefix
+ROUTE_TEMPLATES = {id(route): prefix + route.path for prefix, router in ROUTERS.items() for route in router.routes}
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by path template, not raw path, so model versions in URLs do not explode cardinality
+    route = request.scope.get("route")
+    route = ROUTE_TEMPLATES.get(id(route), route.path) if route is not None else "unmatched"
+    REQUEST_SECONDS.labels(request.method, route, str(response.status_code)).observe(time.perf_counter() - start)
+    # With several workers a scrape reaches only one of them, so each keeps its gauges current itself
+    refresh_gauges()
+    return response
+
+def refresh_gauges():
+    INFLIGHT_REQUESTS.set(executor.inflight)
+    QUEUE_DEPTH.set(registry.queued_images())
+    CACHE_ENTRIES.set(prediction_cache.stats()["entries"])
+
+@app.on_event("startup")
+def startup():
+    # Load and warm up the default model in the background so the container starts listening right away
+    registry.load(MODEL, make_default=True)
+
+@app.on_event("shutdown")
+def shutdown():
+    executor.shutdown()
 
 @app.get("/")
 def read_root(request: Request):
     docs_url = str(request.base_url) + "docs"
-    return {"message": "FastAPI AI inferencing server is live! Go to $docs_url for API documentation.", "docs_url": docs_url}
\ No newline at end of file
+    return {"message": "FastAPI AI inferencing server is live! Go to $docs_url for API documentation.", "docs_url": docs_url}
+
+@app.get("/ready")
+def readiness():
+    """Readiness probe: 200 only once the default model is loaded and warmed up"""
+    if registry.ready.is_set():
+        return {"status": "ready", "model_version": registry.default_version}
+    error = registry.load_error(MODEL)
+    if error:
+        return JSONResponse(content={"status": "failed", "error": error}, status_code=503)
+    return JSONResponse(content={"status": "warming_up"}, status_code=503)
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus scrape endpoint: per-stage latency, batch sizes, throughput, load and process memory. Under
+    app.serve it merges every worker's values (process memory is not reported in that mode).
+    """
+    refresh_gauges()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        metrics_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(metrics_registry)
+        return Response(content=generate_latest(metrics_registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
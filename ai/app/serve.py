@@ -0,0 +1,133 @@
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import torch
+from typing import Dict
+
+# Each worker keeps its own metric values: in multiprocess mode prometheus_client writes them to per-process files
+# in this directory and /metrics merges them. It has to be set before anything imports prometheus_client.
+METRICS_DIR_OWNED = "PROMETHEUS_MULTIPROC_DIR" not in os.environ
+if METRICS_DIR_OWNED:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="ai-metrics-")
+
+from prometheus_client import multiprocess
+import uvicorn
+
+from app.core.config import INFERENCE_BACKEND, MODEL, SERVE_THREADS_PER_WORKER, SERVE_WORKERS
+from app.core.model import load_model
+from app.core.model_cache import ensure_model_artifact
+from app.core.registry import registry
+
+def load_shared_model():
+    """
+    Load the default checkpoint in the parent and move its weights into shared memory, so forked workers
+    all read the same pages instead of holding a copy each. Nothing may run a forward pass before the fork:
+    OpenMP thread pools do not survive it.
+    """
+    if INFERENCE_BACKEND != "torch":
+        # ONNX Runtime sessions own thread pools and are not fork-safe, so each worker loads its own
+        print(f"[Serve] Backend '{INFERENCE_BACKEND}' cannot share a session across processes; workers load their own.")
+        return None
+
+    model = load_model(ensure_model_artifact(MODEL))
+    model.model.eval()
+    model.model.share_memory()
+    print(f"[Serve] Loaded {MODEL} once in the parent ({model.memory_bytes() / 2**20:.1f} MB shared).")
+    return model
+
+def reset_metrics_dir() -> str:
+    """Start from an empty metrics directory: files left by an earlier run would be merged into the new counts"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+    return path
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(sock: socket.socket, model, threads: int, index: int, autotune_path: str):
+    """Worker process body: every worker accepts on the inherited socket and the kernel spreads connections"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+    registry.share_autotune(autotune_path, leader=index == 0)
+    if model is not None:
+        registry.preload(MODEL, model)
+
+    from app.main import app
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-fork AI server: one copy of the weights, one worker process per core group")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS_PER_WORKER, help="torch intra-op threads per worker")
+    args = parser.parse_args()
+
+    metrics_dir = reset_metrics_dir()
+    # Worker 0 writes its startup autotune report here for the others; each run of the server tunes again
+    autotune_path = os.path.join(metrics_dir, "autotune.json")
+    if os.path.exists(autotune_path):
+        os.remove(autotune_path)
+    sock = bind_socket(args.host, args.port)
+    model = load_shared_model()
+    workers: Dict[int, int] = {} # pid -> worker index
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, model, args.threads, index, autotune_path)
+            finally:
+                os._exit(0)
+        workers[pid] = index
+        print(f"[Serve] Started worker {index} (pid {pid}, {args.threads} threads)")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    # Supervise: replace workers that die unexpectedly, exit once all have stopped after a signal
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        multiprocess.mark_process_dead(pid) # Drop its live gauges; its counters and histograms keep counting
+        if index is not None and not stopping:
+            print(f"[Serve] Worker {index} (pid {pid}) exited with status {status}, restarting")
+            spawn(index)
+
+    sock.close()
+    if METRICS_DIR_OWNED:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+    print("[Serve] All workers stopped.")
+
+if __name__ == "__main__":
+    main()
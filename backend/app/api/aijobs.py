@@ -0,0 +1,246 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+import os
+import socket
+from threading import Event, Lock, Thread
+import time
+from typing import Any, Dict, List, Optional, Set
+import uuid
+
+from app.core.config import (
+    AI_JOB_CLAIM_POLL_SECONDS,
+    AI_JOB_LEASE_SECONDS,
+    AI_JOB_MAX_ATTEMPTS,
+    AI_JOB_MAX_LEASED
+)
+from app.core.firebase import db
+
+# lease_expires_at of a job nobody holds: every claimable job (new or with an expired lease) has a lease that
+# ended in the past, so a single range query on one field finds them all, oldest first
+UNLEASED = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+class AIJobQueue:
+    """
+    Durable AI job queue shared by every backend instance, one ai_jobs/{case_id} document per accepted case:
+    {"case": <case data>, "status": "queued" | "leased", "lease_owner", "lease_expires_at", "attempts", "created_at"}.
+
+    Each instance claims up to max_leased jobs in a transaction, renews the leases while their cases wait in
+    AIQueue, and on completion writes the case and deletes the job in one transaction, but only while it still
+    holds the lease. A job whose lease expires (the instance crashed, was scaled in or gave up on the blob) is
+    claimed again by whichever instance polls next; after max_attempts claims it is stored with NULL predictions.
+    """
+
+    COLLECTION_NAME = "ai_jobs"
+
+    def __init__(
+        self,
+        dbmanager,
+        lease_seconds: int = AI_JOB_LEASE_SECONDS,
+        max_leased: int = AI_JOB_MAX_LEASED,
+        poll_seconds: float = AI_JOB_CLAIM_POLL_SECONDS,
+        max_attempts: int = AI_JOB_MAX_ATTEMPTS
+    ):
+        self.dbmanager = dbmanager
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lease_seconds = lease_seconds
+        self._max_leased = max_leased
+        self._poll_seconds = poll_seconds
+        self._max_attempts = max_attempts
+        self._held: Set[str] = set() # Jobs this instance holds a lease on
+        self._lock = Lock()
+        self._wake = Event()
+        self._stopping = Event()
+        self._last_renewal = 0.0
+        self._fetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="aijobs-fetch")
+        self._thread = Thread(target=self._run, name="aijobs-claimer", daemon=True)
+        self._thread.start()
+        print(f"[AIJobQueue] Claiming AI jobs as {self.owner}.")
+
+    def _collection(self):
+        return db.collection(self.COLLECTION_NAME)
+
+    def submit(self, case_id: str, case_data: Dict[str, Any]):
+        """Persist an accepted case as a queued AI job and wake this instance's claimer"""
+        self._collection().document(case_id).create({
+            "case": case_data,
+            "status": "queued",
+            "lease_owner": None,
+            "lease_expires_at": UNLEASED,
+            "attempts": 0,
+            "created_at": firestore.SERVER_TIMESTAMP,
+        })
+        print(f"[AIJobQueue] Queued AI job for case {case_id}.")
+        self._wake.set()
+
+    def exists(self, case_id: str) -> bool:
+        return self._collection().document(case_id).get().exists
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stop claiming new jobs, waiting at most timeout seconds for the claimer. Claimed jobs whose blobs are not
+        being fetched yet are dropped; release_held() hands them back with every other unfinished job.
+        """
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._fetch_pool.shutdown(wait=False, cancel_futures=True)
+
+    def release_held(self):
+        """Hand unfinished jobs back to the queue right away instead of waiting for their leases to expire"""
+        with self._lock:
+            held = list(self._held)
+        if held:
+            self.release(held)
+        print(f"[AIJobQueue] Released {len(held)} unfinished jobs.")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() - self._last_renewal >= self._lease_seconds / 3:
+                    self._renew()
+                claimed = self._claim()
+            except Exception as e:
+                print(f"[AIJobQueue] Claim loop error: {e}")
+                claimed = []
+
+            for job in claimed:
+                try:
+                    self._fetch_pool.submit(self._start, job)
+                except RuntimeError:
+                    break # The pool was shut down by stop(): release_held() hands the jobs back
+            if len(claimed) == 0:
+                self._wake.wait(self._poll_seconds)
+                self._wake.clear()
+
+    def _claim(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            capacity = self._max_leased - len(self._held)
+        if capacity <= 0:
+            return []
+
+        now = datetime.now(timezone.utc)
+        candidates = [
+            doc.reference
+            for doc in self._collection().where("lease_expires_at", "<", now).order_by("lease_expires_at").limit(capacity).stream()
+        ]
+        if not candidates:
+            return []
+
+        @firestore.transactional
+        def claim(transaction) -> List[Dict[str, Any]]:
+            # Another instance may have claimed some candidates since the query ran: only take jobs still unleased
+            now = datetime.now(timezone.utc)
+            jobs = []
+            for snapshot in transaction.get_all(candidates):
+                if not snapshot.exists or snapshot.get("lease_expires_at") >= now:
+                    continue
+                attempts = snapshot.get("attempts") + 1
+                transaction.update(snapshot.reference, {
+                    "status": "leased",
+                    "lease_owner": self.owner,
+                    "lease_expires_at": now + timedelta(seconds=self._lease_seconds),
+                    "attempts": attempts,
+                })
+                jobs.append({"case_id": snapshot.id, "case": snapshot.get("case"), "attempts": attempts})
+            return jobs
+
+        jobs = claim(db.transaction())
+        with self._lock:
+            self._held.update(job["case_id"] for job in jobs)
+        if jobs:
+            print(f"[AIJobQueue] Claimed {len(jobs)} AI jobs.")
+        return jobs
+
+    def _start(self, job: Dict[str, Any]):
+        case_id, case_data = job["case_id"], job["case"]
+        if job["attempts"] > self._max_attempts:
+            print(f"[AIJobQueue] Case {case_id} exceeded {self._max_attempts} attempts, storing NULL predictions.")
+            self.dbmanager.receive_AI_results({case_id: ["NULL"] * len(case_data.get("diagnoses", []))})
+            return
+        try:
+            started = self.dbmanager.enqueue_ai_job(case_id, case_data)
+        except Exception as e:
+            print(f"[AIJobQueue] Failed to start AI job for case {case_id}: {e}")
+            started = False
+        if not started:
+            # Stop renewing: the job is retried by whichever instance claims it after the lease expires
+            with self._lock:
+                self._held.discard(case_id)
+
+    def _renew(self):
+        with self._lock:
+            held = list(self._held)
+        self._last_renewal = time.monotonic()
+        if not held:
+            return
+
+        @firestore.transactional
+        def renew(transaction) -> List[str]:
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=self._lease_seconds)
+            lost = []
+            for snapshot in transaction.get_all([self._collection().document(case_id) for case_id in held]):
+                if snapshot.exists and snapshot.get("lease_owner") == self.owner:
+                    transaction.update(snapshot.reference, {"lease_expires_at": expires_at})
+                else:
+                    lost.append(snapshot.id)
+            return lost
+
+        lost = renew(db.transaction())
+        if lost:
+            print(f"[AIJobQueue] Lost the leases of {len(lost)} jobs to other instances.")
+            with self._lock:
+                self._held.difference_update(lost)
+
+    def release(self, case_ids: List[str]):
+        """Clear this instance's leases on case_ids so any instance can claim them again right away"""
+        @firestore.transactional
+        def unlease(transaction):
+            for snapshot in transaction.get_all([self._collection().document(case_id) for case_id in case_ids]):
+                if snapshot.exists and snapshot.get("lease_owner") == self.owner:
+                    transaction.update(snapshot.reference, {"status": "queued", "lease_owner": None, "lease_expires_at": UNLEASED})
+
+        try:
+            unlease(db.transaction())
+        finally:
+            with self._lock:
+                self._held.difference_update(case_ids)
+
+    def complete(self, cases: Dict[str, Dict[str, Any]]) -> List[str]:
+        """
+        Atomically store finished cases and delete their jobs. cases maps case_id to a function of the job's case
+        data that returns the document to write (or None to skip it). Returns the case ids that were written;
+        jobs whose lease this instance no longer holds are skipped, their new owner will write them. If the
+        transaction fails, the leases are released so the jobs are retried instead of being renewed forever.
+        """
+        @firestore.transactional
+        def commit(transaction) -> List[str]:
+            written = []
+            for snapshot in transaction.get_all([self._collection().document(case_id) for case_id in cases]):
+                if not snapshot.exists or snapshot.get("lease_owner") != self.owner:
+                    print(f"[AIJobQueue] No longer holding the lease of case {snapshot.id}, skipping its results.")
+                    continue
+                case_data = cases[snapshot.id](snapshot.get("case"))
+                if case_data is None:
+                    continue
+                transaction.set(db.collection("cases").document(snapshot.id), case_data)
+                transaction.delete(snapshot.reference)
+                written.append(snapshot.id)
+            return written
+
+        try:
+            return commit(db.transaction())
+        except Exception:
+            self.release_quietly(list(cases))
+            raise
+        finally:
+            with self._lock:
+                self._held.difference_update(cases)
+
+    def release_quietly(self, case_ids: List[str]):
+        """release() for error paths: if Firestore is unreachable the leases are left to expire"""
+        try:
+            self.release(case_ids)
+            print(f"[AIJobQueue] Released {len(case_ids)} jobs for retry.")
+        except Exception as e:
+            print(f"[AIJobQueue] Failed to release {len(case_ids)} jobs, they are retried once their leases expire: {e}")
@@ -1,122 +1,352 @@
+import hashlib
 from io import BytesIO
-from threading import Lock, Timer
-from typing import Any, Dict
-import base64
-import requests
+import json
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Event, Lock, Thread
+from typing import Any, Dict, List, Optional, Tuple
+import struct
 import time
 import logging
+from PIL import Image
 
-from app.core.config import AI_URL
+from app.core.config import (
+    AI_BATCH_MAX_WAIT_SECONDS,
+    AI_BATCH_TARGET_IMAGES,
+    AI_CALLBACK_SECRET,
+    AI_CALLBACK_URL,
+    AI_IMAGE_DOWNSCALE,
+    AI_IMAGE_JPEG_QUALITY,
+    AI_IMAGE_MIN_SIDE,
+    AI_JOB_POLL_SECONDS,
+    AI_JOB_TIMEOUT_SECONDS,
+    AI_MAX_CONCURRENT_FLUSHES,
+    AI_STORE_EMBEDDINGS,
+    AI_URL
+)
+from app.core.http_client import http_clients, timeout_or_default
 
 logger = logging.getLogger(__name__)
 
+def downscale_jpeg(image_bytes: bytes, min_side: int = AI_IMAGE_MIN_SIDE, quality: int = AI_IMAGE_JPEG_QUALITY) -> bytes:
+    """
+    Shrink a JPEG by 1/2, 1/4 or 1/8 in the DCT domain (PIL draft mode) while keeping both sides at least min_side.
+    Anything else (other formats, images under twice min_side, undecodable bytes) is returned unchanged.
+    """
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        if img.format != "JPEG" or min(img.size) < 2 * min_side:
+            return image_bytes
+        img.draft("RGB", (min_side, min_side))
+        buffered = BytesIO()
+        img.convert("RGB").save(buffered, format="JPEG", quality=quality)
+    except Exception:
+        return image_bytes # Let the AI service report images it cannot decode
+    return buffered.getvalue()
+
+def encode_case(case_id: str, image_bytes_list: List[bytes], downscale: bool = AI_IMAGE_DOWNSCALE) -> bytes:
+    """
+    Case-keyed body for the AI service: a header frame with {"case_id", "images"} followed by one frame per encoded
+    image, each frame being [4-byte big-endian length][bytes]. Whole cases can be concatenated into one request.
+    Images are sent as given unless downscale is set (see downscale_jpeg).
+    """
+    if downscale:
+        image_bytes_list = [downscale_jpeg(image_bytes) for image_bytes in image_bytes_list]
+    payload = BytesIO()
+    header = json.dumps({"case_id": case_id, "images": len(image_bytes_list)}).encode("utf-8")
+    payload.write(struct.pack(">I", len(header)))
+    payload.write(header)
+    for image_bytes in image_bytes_list:
+        payload.write(struct.pack(">I", len(image_bytes)))
+        payload.write(image_bytes)
+    return payload.getvalue()
+
+def infer_cases(cases: List[Tuple[str, List[bytes]]], model_version: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Synchronous case-keyed inference through the AI service's streaming /inference/cases route.
+
+    Returns:
+        Per-case results keyed by case_id: {"status": "ok", "predictions", "model_version"} or
+        {"status": "error", "error", "retryable"}. Cases missing from the response are absent.
+    """
+    body = b"".join(encode_case(case_id, images) for case_id, images in cases)
+    params = {"model_version": model_version} if model_version else {}
+    results = {}
+    with http_clients.client(AI_URL).stream(
+        "POST",
+        f"{AI_URL}/inference/cases",
+        params=params,
+        content=body,
+        headers={"Content-Type": "application/octet-stream"},
+        timeout=timeout_or_default(timeout)
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                result = json.loads(line)
+                results[result.pop("case_id")] = result
+    return results
+
 class AIQueue:
+    """
+    Batches new cases for AI inference. Cases hold their images as the original encoded bytes, which are
+    forwarded to the AI service without being decoded here.
+
+    A single scheduler thread hands queued cases to a bounded flush pool as soon as they add up to
+    batch_target_images images, or once the oldest queued case has waited batch_max_wait_seconds. Under load
+    batches fill up before the deadline; when traffic is sparse a lone case waits at most batch_max_wait_seconds.
+    While max_concurrent_flushes batches are in flight, new cases keep queueing instead of spawning threads.
+    """
+
     def __init__(
         self,
         dbmanager,
-        flush_interval_seconds: int = 3600,
-        flush_maximum_cases: int = 1,
+        batch_target_images: int = AI_BATCH_TARGET_IMAGES,
+        batch_max_wait_seconds: float = AI_BATCH_MAX_WAIT_SECONDS,
+        max_concurrent_flushes: int = AI_MAX_CONCURRENT_FLUSHES,
         inference_timeout_seconds: int = 60,
         max_retries: int = 3,
-        retry_backoff_base: float = 2.0
+        retry_backoff_base: float = 2.0,
+        job_timeout_seconds: int = AI_JOB_TIMEOUT_SECONDS,
+        job_poll_seconds: float = AI_JOB_POLL_SECONDS
     ):
         self.dbmanager = dbmanager
-        self._new_cases: Dict[str, Dict[str, Any]] = {} # Cases waiting to be flushed
-        self._flush_interval_seconds = flush_interval_seconds
-        self._flush_maximum_cases = flush_maximum_cases
+        self._new_cases: Dict[str, Dict[str, Any]] = {} # Cases waiting to be flushed, oldest first
+        self._queued_images = 0
+        self._batch_target_images = batch_target_images
+        self._batch_max_wait_seconds = batch_max_wait_seconds
+        self._max_concurrent_flushes = max_concurrent_flushes
+        self._active_flushes = 0
+        self._closing = False
         self._inference_timeout_seconds = inference_timeout_seconds
         self._max_retries = max_retries
         self._retry_backoff_base = retry_backoff_base
+        self._job_timeout_seconds = job_timeout_seconds
+        self._job_poll_seconds = job_poll_seconds
+        self._job_events: Dict[str, Event] = {} # AI jobs this instance is waiting for
+        self._job_results: Dict[str, Dict[str, Any]] = {} # Finished jobs delivered by callback
         self._lock = Lock()
-        self._start_periodic_flush()
+        self._changed = Condition(self._lock) # New case, finished flush or close
+        self._flush_pool = ThreadPoolExecutor(max_workers=max_concurrent_flushes, thread_name_prefix="aiqueue-flush")
+        self._scheduler = Thread(target=self._schedule, name="aiqueue-scheduler", daemon=True)
+        self._scheduler.start()
+        print(
+            f"[AIQueue] Scheduler started: flush at {batch_target_images} images or after {batch_max_wait_seconds} seconds, "
+            f"at most {max_concurrent_flushes} flushes at a time."
+        )
 
-    def _start_periodic_flush(self):
-        self._flush()
-        t = Timer(self._flush_interval_seconds, self._start_periodic_flush)
-        t.daemon = True
-        t.start()
-        print(f"[AIQueue] Periodic flush started every {self._flush_interval_seconds} seconds.")
+    def receive_new_case(self, case_id: str, images: List[bytes]):
+        with self._changed:
+            if case_id in self._new_cases:
+                self._queued_images -= len(self._new_cases.pop(case_id)["images"])
+            self._new_cases[case_id] = {"images": images, "queued_at": time.monotonic()}
+            self._queued_images += len(images)
+            self._changed.notify_all()
+            print(f"[AIQueue] Received new case: {case_id}. Total cases in queue: {len(self._new_cases)}")
 
-    def receive_new_case(self, case_id: str, images):
-        with self._lock:
-            self._new_cases[case_id] = {"images": images}
-        print(f"[AIQueue] Received new case: {case_id}. Total cases in queue: {len(self._new_cases)}")
-        self._check_cases_amount()
-    
-    def _check_cases_amount(self):
-        with self._lock:
-            if len(self._new_cases) >= self._flush_maximum_cases:
-                print(f"[AIQueue] Cache reached maximum cases ({self._flush_maximum_cases}).")
-                Timer(0, self._flush).start()
+    def close(self, timeout: Optional[float] = None):
+        """
+        Flush every queued case right away, then wait for in-flight flushes to finish, for at most timeout seconds
+        (None waits for all of them). Cases still queued at the deadline are dropped and unfinished flushes are
+        abandoned: their AI jobs are re-delivered by the durable queue once released or expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            self._closing = True
+            self._changed.notify_all()
+            while self._new_cases or self._active_flushes:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            dropped, unfinished = len(self._new_cases), self._active_flushes
+            self._new_cases.clear()
+            self._queued_images = 0
+            self._changed.notify_all()
+        self._scheduler.join()
+        self._flush_pool.shutdown(wait=False, cancel_futures=True)
+        if dropped or unfinished:
+            print(f"[AIQueue] Closed after {timeout} seconds, leaving {dropped} queued cases and {unfinished} flushes unfinished.")
+        else:
+            print("[AIQueue] Closed.")
 
-    def _flush(self):
-        with self._lock:
-            if len(self._new_cases) == 0:
-                print("[AIQueue] No new cases to flush.")
-                return
+    def _schedule(self):
+        while True:
+            with self._changed:
+                while True:
+                    if self._closing and not self._new_cases:
+                        return
+                    timeout = None # Nothing queued: sleep until a case arrives
+                    if self._new_cases:
+                        oldest_at = next(iter(self._new_cases.values()))["queued_at"]
+                        timeout = oldest_at + self._batch_max_wait_seconds - time.monotonic()
+                        due = self._closing or self._queued_images >= self._batch_target_images or timeout <= 0
+                        if due and self._active_flushes < self._max_concurrent_flushes:
+                            break
+                        if due:
+                            timeout = None # At the flush cap: sleep until a flush finishes
+                    self._changed.wait(timeout)
 
-            flush_data = dict(self._new_cases)
-            self._new_cases.clear()
+                flush_data = self._take_batch()
+                self._active_flushes += 1
+            self._flush_pool.submit(self._run_flush, flush_data)
+
+    def _take_batch(self) -> Dict[str, Dict[str, Any]]:
+        """Oldest cases up to batch_target_images images (always at least one case). Caller holds the lock."""
+        flush_data = {}
+        images = 0
+        for case_id in list(self._new_cases):
+            case_images = len(self._new_cases[case_id]["images"])
+            if flush_data and images + case_images > self._batch_target_images:
+                break
+            flush_data[case_id] = self._new_cases.pop(case_id)
+            images += case_images
+        self._queued_images -= images
+        return flush_data
 
+    def _run_flush(self, flush_data: Dict[str, Dict[str, Any]]):
+        try:
+            self._flush(flush_data)
+        except Exception as e:
+            logger.error(f"AIQueue flush failed: {e}", extra={"service": "ai_inference"})
+            # Hand the cases back to the durable queue; jobs already written are gone and are skipped
+            self.dbmanager.aijobs.release_quietly(list(flush_data))
+        finally:
+            with self._changed:
+                self._active_flushes -= 1
+                self._changed.notify_all()
+
+    def _flush(self, flush_data: Dict[str, Dict[str, Any]]):
         print(f"[AIQueue] Flushing {len(flush_data)} new cases to AI for diagnosis...")
 
-        all_images = []
-        case_to_slice = {}
-        for case_id, case_data in flush_data.items():
-            start_idx = len(all_images)
-            all_images.extend(case_data["images"])  # Adds 9 images
-            case_to_slice[case_id] = (start_idx, start_idx + 9)
-
-        image_payload = []
-        for img in all_images:
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG")
-            image_b64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            image_payload.append(image_b64)
-
-        # Attempt inference with retry mechanism
-        predictions = None
+        # Encode every case once; retries resend only the cases that still need predictions
+        encoded_cases = {case_id: encode_case(case_id, case_data["images"]) for case_id, case_data in flush_data.items()}
+        results: Dict[str, List[str]] = {}
+        failed: Dict[str, str] = {} # Cases the AI service rejected for good (e.g. undecodable images)
+        remaining = list(encoded_cases)
+        model_version = None
         last_error = None
+        finished_job_id = "" # Last job that reached a terminal state; salts the key so retries start a new job
 
         for attempt in range(self._max_retries):
             try:
-                print(f"[AIQueue] Inference attempt {attempt + 1}/{self._max_retries}...")
-                response = requests.post(
-                    url=f"{AI_URL}/inference/predict",
-                    json={"images": image_payload},
-                    timeout=self._inference_timeout_seconds
-                )
-                response.raise_for_status()
-                predictions = response.json()["predictions"]
-                print(f"[AIQueue] Inference successful on attempt {attempt + 1}")
-                break
+                print(f"[AIQueue] Inference attempt {attempt + 1}/{self._max_retries} for {len(remaining)} cases...")
+                # The same cases map to the same key until a job finishes, so a resubmission after a lost response
+                # or a slow job returns the job the AI service is already working on instead of starting the batch
+                # again. Once a job has finished, reattaching would only return its stored result or errors.
+                key_source = "\n".join(sorted(remaining) + [finished_job_id])
+                idempotency_key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+                job_id = self._submit_job(b"".join(encoded_cases[case_id] for case_id in remaining), idempotency_key)
+                job = self._await_job(job_id)
+                finished_job_id = job_id
+                if job["status"] == "failed":
+                    raise RuntimeError(f"AI job {job_id} failed: {job.get('error')}")
+                job_result = job["result"]
+                model_version = job_result.get("model_version")
+
+                for case_id, case_result in job_result["cases"].items():
+                    if case_id not in remaining:
+                        continue
+                    if case_result["status"] == "ok":
+                        results[case_id] = case_result["predictions"]
+                    elif not case_result.get("retryable", True):
+                        failed[case_id] = case_result.get("error")
+                    else:
+                        last_error = case_result.get("error")
+                        continue
+                    remaining.remove(case_id)
             except Exception as e:
                 last_error = e
                 logger.error(f"AI inference attempt {attempt + 1} failed: {e}", extra={"service": "ai_inference", "attempt": attempt + 1})
 
-                # If not the last attempt, wait with exponential backoff
-                if attempt < self._max_retries - 1:
-                    backoff_time = self._retry_backoff_base ** attempt
-                    print(f"[AIQueue] Retrying in {backoff_time} seconds...")
-                    time.sleep(backoff_time)
+            if not remaining:
+                print(f"[AIQueue] Inference finished on attempt {attempt + 1}")
+                break
+            # If not the last attempt, wait with exponential backoff
+            if attempt < self._max_retries - 1:
+                backoff_time = self._retry_backoff_base ** attempt
+                print(f"[AIQueue] Retrying {len(remaining)} cases in {backoff_time} seconds...")
+                time.sleep(backoff_time)
 
-        # If all retries failed, use NULL fallback values
-        if predictions is None:
+        for case_id, error in failed.items():
+            logger.error(f"AI inference rejected case {case_id}: {error}. Proceeding with NULL fallback values", extra={"service": "ai_inference", "case_id": case_id})
+        if remaining:
             logger.error(
                 f"AI inference service DOWN - all {self._max_retries} retries failed. Last error: {last_error}. "
-                f"Proceeding with NULL fallback values for {len(flush_data)} cases",
+                f"Proceeding with NULL fallback values for {len(remaining)} cases",
                 extra={"service": "ai_inference", "status": "service_down", "total_retries": self._max_retries, "error": str(last_error)}
             )
 
-            # Create NULL predictions for all images
-            total_images = len(all_images)
-            predictions = ["NULL"] * total_images
+        # Always send results to DbManager (either real predictions or NULL values)
+        if results:
+            self.dbmanager.receive_AI_results(results, model_version=model_version)
+            if AI_STORE_EMBEDDINGS:
+                self._store_embeddings({case_id: encoded_cases[case_id] for case_id in results}, model_version)
+        fallback = {case_id: ["NULL"] * len(flush_data[case_id]["images"]) for case_id in list(failed) + remaining}
+        if fallback:
+            self.dbmanager.receive_AI_results(fallback)
+
+    def _store_embeddings(self, encoded_cases: Dict[str, bytes], model_version: Optional[str]):
+        """Index finished cases for similar-case search. Best effort: their predictions are already stored."""
+        try:
+            response = http_clients.client(AI_URL).post(
+                url=f"{AI_URL}/embeddings/cases",
+                params={"model_version": model_version} if model_version else {},
+                content=b"".join(encoded_cases.values()),
+                headers={"Content-Type": "application/octet-stream"},
+                timeout=self._inference_timeout_seconds
+            )
+            response.raise_for_status()
+            stored = sum(case_result["status"] == "ok" for case_result in response.json()["cases"].values())
+            print(f"[AIQueue] Stored embeddings of {stored}/{len(encoded_cases)} cases.")
+        except Exception as e:
+            logger.error(f"Storing embeddings failed: {e}", extra={"service": "ai_embeddings"})
+
+    def _submit_job(self, image_payload: bytes, idempotency_key: str) -> str:
+        params = {}
+        if AI_CALLBACK_URL and AI_CALLBACK_SECRET:
+            params["callback_url"] = AI_CALLBACK_URL
+        response = http_clients.client(AI_URL).post(
+            url=f"{AI_URL}/inference/jobs/cases",
+            params=params,
+            content=image_payload,
+            headers={"Content-Type": "application/octet-stream", "Idempotency-Key": idempotency_key},
+            timeout=self._inference_timeout_seconds
+        )
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        print(f"[AIQueue] Submitted AI job {job_id}.")
+        return job_id
+
+    def _await_job(self, job_id: str) -> Dict[str, Any]:
+        """Wait until a job succeeds or fails, woken early by the callback and polling in between; returns the job"""
+        event = Event()
+        with self._lock:
+            self._job_events[job_id] = event
+        try:
+            deadline = time.monotonic() + self._job_timeout_seconds
+            while time.monotonic() < deadline:
+                if event.wait(self._job_poll_seconds):
+                    with self._lock:
+                        job = self._job_results.pop(job_id)
+                else:
+                    response = http_clients.client(AI_URL).get(f"{AI_URL}/inference/jobs/{job_id}", timeout=self._inference_timeout_seconds)
+                    response.raise_for_status()
+                    job = response.json()
 
-        # Build results dictionary
-        results = {}
-        for case_id, (start, end) in case_to_slice.items():
-            case_preds = predictions[start:end]
-            results[case_id] = case_preds
+                if job["status"] in ("succeeded", "failed"):
+                    return job
+            raise TimeoutError(f"AI job {job_id} did not finish within {self._job_timeout_seconds} seconds")
+        finally:
+            with self._lock:
+                self._job_events.pop(job_id, None)
+                self._job_results.pop(job_id, None)
 
-        # Always send results to DbManager (either real predictions or NULL values)
-        self.dbmanager.receive_AI_results(results)
\ No newline at end of file
+    def receive_job_callback(self, job: Dict[str, Any]) -> bool:
+        """Hand a finished job POSTed by the AI service to the flush waiting for it"""
+        with self._lock:
+            event = self._job_events.get(job.get("job_id"))
+            if event is None:
+                return False # Not ours or already collected by polling
+            self._job_results[job["job_id"]] = job
+        event.set()
+        return True
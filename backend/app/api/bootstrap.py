@@ -1,6 +1,14 @@
 from app.api.dbmanager import DbManager
+from app.api.aijobs import AIJobQueue
 from app.api.aiqueue import AIQueue
+from app.core.config import AI_SWEEP_ENABLED
+from app.services.ai_sweeper import NullPredictionSweeper
 
 dbmanager = DbManager(aiqueue=None)
 aiqueue = AIQueue(dbmanager=dbmanager)
-dbmanager.aiqueue = aiqueue
\ No newline at end of file
+dbmanager.aiqueue = aiqueue
+aijobs = AIJobQueue(dbmanager=dbmanager)
+dbmanager.aijobs = aijobs
+sweeper = NullPredictionSweeper()
+if AI_SWEEP_ENABLED:
+    sweeper.start()
\ No newline at end of file
@@ -1,9 +1,8 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from google.cloud import firestore
 from io import BytesIO
 from nanoid import generate
 from pathlib import Path
-from PIL import Image
 # from sendgrid import SendGridAPIClient
 # from sendgrid.helpers.mail import Attachment, Disposition, FileContent, FileName, FileType, Mail
 from typing import Any, Dict, List, Optional
@@ -11,7 +10,6 @@ import base64
 import json
 import pandas as pd
 import pyzipper
-import requests
 import secrets
 import string
 import tempfile
@@ -21,35 +19,58 @@ from app.api.storage import Storage
 from app.core.config import PASSWORD
 # from app.core.config import SENDGRID_API_KEY, SENDGRID_SENDER_EMAIL
 from app.core.crypto import CryptoUtils
+from app.core.http_client import http_clients, timeout_or_default
 from app.core.firebase import bucket, db
 
 class DbManager:
-    def __init__(self, aiqueue):
+    def __init__(self, aiqueue, aijobs=None):
         self.aiqueue = aiqueue
-        self.pending_cases: Dict[str, Dict[str, Any]] = {}  # Data of cases that have already been sent to AIQueue
+        self.aijobs = aijobs # Durable queue of cases accepted but not yet stored with AI results
 
     def uniquify_id(self, case_id: str, max_trials: int = 5, size: int = 8) -> str:
         doc_ref = db.collection("cases").document(case_id)
         trial = 0
 
-        while (doc_ref.get().exists or case_id in self.pending_cases) and trial < max_trials:
+        while (doc_ref.get().exists or self.aijobs.exists(case_id)) and trial < max_trials:
             print(f"[DbManager] Collision detected for {case_id}, generating a new one (trial {trial+1})")
             case_id = generate(size=size)
             print(f"[DbManager] Generated new case ID: {case_id}")
             doc_ref = db.collection("cases").document(case_id)
             trial += 1
 
-        if trial == max_trials and (doc_ref.get().exists or case_id in self.pending_cases):
+        if trial == max_trials and (doc_ref.get().exists or self.aijobs.exists(case_id)):
             print(f"[DbManager] Failed to generate unique case ID after {trial} trials")
             raise ValueError(f"Failed to generate unique case ID after {trial} trials")
 
         return case_id
 
-    def enqueue_ai_job(self, case_id: str, case_data: Dict[str, Any]):
+    def enqueue_ai_job(self, case_id: str, case_data: Dict[str, Any]) -> bool:
         # 1. download encrypted blob from Firebase Storage
         # 2. decrypt blob using aes key
         # 3. extract 9 images from decrypted blob in order
-        # 4. send case_id: [9 images] to AIQueue for AI diagnosis
+        # 4. send case_id: [9 encoded images] to AIQueue for AI diagnosis, as-is: the AI service decodes them
+        try:
+            image_bytes_list = self.fetch_case_images(case_id, case_data)
+        except Exception as e:
+            print(f"[DbManager] {e}. Cannot enqueue AI job.")
+            return False
+        if len(image_bytes_list) != 9:
+            print(f"[DbManager] Invalid number of images for case {case_id}. Cannot enqueue AI job.")
+            return False
+
+        self.aiqueue.receive_new_case(case_id, image_bytes_list)
+        print(f"[DbManager] Enqueued AI job for case: {case_id}")
+        return True
+
+    @staticmethod
+    def fetch_case_images(case_id: str, case_data: Dict[str, Any], timeout: Optional[float] = None) -> List[bytes]:
+        """
+        Download a case's encrypted blob and decrypt it into the original encoded image bytes, in order.
+
+        Raises:
+            ValueError: if the case has no usable encrypted blob
+            RuntimeError: if the download fails
+        """
         encrypted_aes = case_data.get("encrypted_aes", {})
         ciphertext = encrypted_aes.get("ciphertext")
         iv = encrypted_aes.get("iv")
@@ -65,18 +86,16 @@ class DbManager:
         url = encrypted_blob.get("url", "NULL")
         iv = encrypted_blob.get("iv", "NULL")
         if url == "NULL" or iv == "NULL":
-            print(f"[DbManager] Invalid encrypted blob for case {case_id}. Cannot enqueue AI job.")
-            return
+            raise ValueError(f"Invalid encrypted blob for case {case_id}")
         print(f"[DbManager] Downloading blob from URL: {url}")
         try:
-            response = requests.get(url)
+            response = http_clients.client(url).get(url, timeout=timeout_or_default(timeout))
             if response.status_code != 200:
                 raise RuntimeError(f"Failed to download blob: {response.status_code}")
             encrypted_blob = base64.b64encode(response.content).decode('utf-8')
         except Exception as e:
-            print(f"[DbManager] Error downloading blob for case {case_id}: {e}")
-            return
-        
+            raise RuntimeError(f"Error downloading blob for case {case_id}: {e}")
+
         print(f"[DbManager] Decrypting blob...")
         decrypted_data = CryptoUtils.decrypt_string(
             encrypted_blob,
@@ -84,53 +103,36 @@ class DbManager:
             aes_key
         )
         image_b64_list = json.loads(decrypted_data).get("images", [])
-        if len(image_b64_list) != 9:
-            print(f"[DbManager] Invalid number of images for case {case_id}. Cannot enqueue AI job.")
-            return
-
-        images = []
-        for b64_str in image_b64_list:
-            img_bytes = base64.b64decode(b64_str)
-            img = Image.open(BytesIO(img_bytes)).convert("RGB")
-            images.append(img)
-
-        self.aiqueue.receive_new_case(case_id, images)
-        print(f"[DbManager] Enqueued AI job for case: {case_id}")
-
-    def receive_AI_results(self, results: Dict[str, Any]):
-        new_cases = {}
-        for case_id, predictions in results.items():
-            if case_id not in self.pending_cases:
-                print(f"[DbManager] Warning: Received AI result for unknown case_id: {case_id}")
-                continue
-            case_data = self.pending_cases[case_id]
-
-            diagnoses = case_data.get("diagnoses", [])
-            if len(diagnoses) != len(predictions):
-                print(f"[DbManager] Mismatch between diagnosis count and predictions for case {case_id}")
-                continue
-
-            for i in range(len(diagnoses)):
-                diagnoses[i]["ai_lesion_type"] = predictions[i]
-
-            case_data["diagnoses"] = diagnoses
-            new_cases[case_id] = case_data
-            del self.pending_cases[case_id]
-        
-        self._batch_write_new_cases(new_cases)
-
-    def _batch_write_new_cases(self, new_cases: Dict[str, Dict[str, Any]]):
-        print(f"[DbManager] Batch writing {len(new_cases)} cases to Firestore...")
-        try:
-            batch = db.batch()
-            for case_id, case_data in new_cases.items():
+        return [base64.b64decode(b64_str) for b64_str in image_b64_list]
+
+    def receive_AI_results(self, results: Dict[str, Any], model_version: Optional[str] = None):
+        # model_version is None for "NULL" fallback results
+        def with_predictions(case_id: str, predictions: List[str]):
+            def build(case_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+                diagnoses = case_data.get("diagnoses", [])
+                if len(diagnoses) != len(predictions):
+                    print(f"[DbManager] Mismatch between diagnosis count and predictions for case {case_id}")
+                    return None
+
+                for i in range(len(diagnoses)):
+                    diagnoses[i]["ai_lesion_type"] = predictions[i]
+
+                case_data["diagnoses"] = diagnoses
+                case_data["ai_model_version"] = model_version
                 case_data["submitted_at"] = firestore.SERVER_TIMESTAMP
-                doc_ref = db.collection("cases").document(case_id)
-                batch.set(doc_ref, case_data)
-            batch.commit()
-            print(f"[DbManager] Batch wrote {len(new_cases)} cases to Firestore.")
+                if "NULL" in predictions:
+                    # Flag for NullPredictionSweeper, which re-infers the case once the AI service is back
+                    case_data["ai_retry_at"] = datetime.now(timezone.utc)
+                    case_data["ai_retry_attempts"] = 0
+                return case_data
+            return build
+
+        print(f"[DbManager] Writing {len(results)} cases to Firestore...")
+        try:
+            written = self.aijobs.complete({case_id: with_predictions(case_id, predictions) for case_id, predictions in results.items()})
+            print(f"[DbManager] Wrote {len(written)} cases to Firestore.")
         except Exception as e:
-            print(f"[DbManager] Error batch writing cases: {str(e)}")
+            print(f"[DbManager] Error writing cases: {str(e)}")
 
     def get_case_by_id(self, case_id: str) -> Optional[Dict]:
         doc = db.collection("cases").document(case_id).get()
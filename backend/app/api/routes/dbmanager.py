@@ -2,17 +2,20 @@ from dateutil import parser
 from fastapi import APIRouter, BackgroundTasks, Query, Request
 from fastapi.responses import JSONResponse
 # from fastapi.responses import StreamingResponse
+import hashlib
+import hmac
+import json
 from typing import Any, Dict
 
 from app.api.auth import verify_token
-from app.api.bootstrap import dbmanager
+from app.api.bootstrap import aiqueue, dbmanager
+from app.core.config import AI_CALLBACK_SECRET
 
 dbmanager_router = APIRouter()
 
 @dbmanager_router.post("/case/create")
 async def create_case(
     request: Request,
-    background_tasks: BackgroundTasks,
     case_id: str = Query(...)
 ):
     uid, role, _, _ = verify_token(request)
@@ -34,17 +37,27 @@ async def create_case(
         # 3. ensure case_id is unique
         case_id = dbmanager.uniquify_id(case_id)
 
-        # 4. store case in cache
-        dbmanager.pending_cases[case_id] = data
-
-        # 5. queue job for AI diagnosis
-        background_tasks.add_task(dbmanager.enqueue_ai_job, case_id, data)
+        # 4. store case as a durable job for AI diagnosis (any backend instance may process it)
+        dbmanager.aijobs.submit(case_id, data)
 
         return JSONResponse(content={"case_id": case_id}, status_code=200)
 
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@dbmanager_router.post("/ai/callback")
+async def ai_job_callback(request: Request):
+    """Finished AI jobs are POSTed here by the AI service, signed with the shared AI_CALLBACK_SECRET"""
+    body = await request.body()
+    if not AI_CALLBACK_SECRET:
+        return JSONResponse(content={"error": "Callbacks are disabled"}, status_code=404)
+    expected = hmac.new(AI_CALLBACK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(request.headers.get("X-Job-Signature", ""), expected):
+        return JSONResponse(content={"error": "Unauthorized"}, status_code=403)
+
+    accepted = aiqueue.receive_job_callback(json.loads(body))
+    return JSONResponse(content={"accepted": accepted}, status_code=200)
+
 @dbmanager_router.get("/case/get/{case_id}")
 def get_case(case_id: str, request: Request):
     _, role, _, _ = verify_token(request)
@@ -199,10 +212,12 @@ async def export_bundle(request: Request, include_all: bool = False, expiry_days
 #         }
     
 # AIQueue flow:
+# 0. /case/create stores the case as an ai_jobs document; an AIJobQueue on any instance leases it and has DbManager download its images
 # 1. AIQueue receives new cases from DbManager and adds them to the queue
-# 2. AIQueue flush cases to AI diagnosis service for batch inference (time interval or max cases reached)
-# 3. AIQueue wait with timeout for AI diagnosis service to return results
+# 2. AIQueue scheduler flushes cases to AI diagnosis service for batch inference (target image count reached or oldest case waited long enough)
+# 3. AIQueue submits an AI job and waits for its callback or polls it until the job timeout
 # 4. AIQueue append diagnosis results to case id (no results / exceed timeout = "FAILED") and send back to DbManager
+# 5. DbManager writes the case and deletes its job in one transaction, as long as this instance still holds the lease
 
 # the tasks of dbmanager include:
 # - store newly created case
@@ -15,4 +15,62 @@ FIREBASE_BUCKET_NAME = os.getenv("FIREBASE_BUCKET_NAME")
 if GOOGLE_CLOUD_RUN:
     AI_URL = os.getenv("AI_URL")
 else:
-    AI_URL = "http://localhost:8001"
\ No newline at end of file
+    AI_URL = "http://localhost:8001"
+
+# AI inference runs as asynchronous jobs: AIQueue submits a batch, then waits for the callback (when
+# AI_CALLBACK_URL and AI_CALLBACK_SECRET are set) or polls the job every AI_JOB_POLL_SECONDS
+AI_JOB_TIMEOUT_SECONDS = int(os.getenv("AI_JOB_TIMEOUT_SECONDS", "900"))
+AI_JOB_POLL_SECONDS = float(os.getenv("AI_JOB_POLL_SECONDS", "2"))
+AI_CALLBACK_URL = os.getenv("AI_CALLBACK_URL") # e.g. https://<backend>/dbmanager/ai/callback
+AI_CALLBACK_SECRET = os.getenv("AI_CALLBACK_SECRET") # Same value as JOB_CALLBACK_SECRET on the AI service
+
+# AIQueue batching: a single scheduler thread flushes queued cases once they hold AI_BATCH_TARGET_IMAGES images or
+# the oldest one has waited AI_BATCH_MAX_WAIT_SECONDS, with at most AI_MAX_CONCURRENT_FLUSHES batches in flight
+AI_BATCH_TARGET_IMAGES = int(os.getenv("AI_BATCH_TARGET_IMAGES", "36"))
+AI_BATCH_MAX_WAIT_SECONDS = float(os.getenv("AI_BATCH_MAX_WAIT_SECONDS", "5"))
+AI_MAX_CONCURRENT_FLUSHES = int(os.getenv("AI_MAX_CONCURRENT_FLUSHES", "2"))
+# Shutdown (stopping the sweeper and job claimer, flushing queued cases, awaiting in-flight flushes) takes at most
+# AI_SHUTDOWN_TIMEOUT_SECONDS, keeping within the container's SIGTERM grace period; unfinished jobs are released to the
+# durable queue and re-delivered
+AI_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("AI_SHUTDOWN_TIMEOUT_SECONDS", "8"))
+# After a flush stores its predictions, the cases' images are also indexed by the AI service for similar-case search
+AI_STORE_EMBEDDINGS = os.getenv("AI_STORE_EMBEDDINGS", "true").lower() == "true"
+
+# Case images go to the AI service as the original compressed bytes from the decrypted blob. With AI_IMAGE_DOWNSCALE,
+# JPEGs at least twice AI_IMAGE_MIN_SIDE on their short side are first shrunk by 1/2 to 1/8 in the DCT domain (PIL draft
+# mode, no full-size decode), keeping both sides >= AI_IMAGE_MIN_SIDE (the model input size), and re-encoded at
+# AI_IMAGE_JPEG_QUALITY
+AI_IMAGE_DOWNSCALE = os.getenv("AI_IMAGE_DOWNSCALE", "false").lower() == "true"
+AI_IMAGE_MIN_SIDE = int(os.getenv("AI_IMAGE_MIN_SIDE", "288"))
+AI_IMAGE_JPEG_QUALITY = int(os.getenv("AI_IMAGE_JPEG_QUALITY", "90"))
+
+# Durable AI job queue (Firestore ai_jobs collection) shared by all backend instances: an accepted case waits there
+# until an instance leases it. Leases last AI_JOB_LEASE_SECONDS and are renewed while the case is processed; a job
+# whose lease expires (crash, scale-in) is claimed again, and stored with NULL predictions after AI_JOB_MAX_ATTEMPTS
+AI_JOB_LEASE_SECONDS = int(os.getenv("AI_JOB_LEASE_SECONDS", "300"))
+AI_JOB_MAX_LEASED = int(os.getenv("AI_JOB_MAX_LEASED", "16")) # Jobs one instance holds at a time
+AI_JOB_CLAIM_POLL_SECONDS = float(os.getenv("AI_JOB_CLAIM_POLL_SECONDS", "5"))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "5"))
+
+# Outbound HTTP (Storage downloads, AI service calls) goes through pooled keep-alive clients, one pool per host
+# (see app.core.http_client). HTTP/2 is used when the server supports it and the h2 package is installed
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "32"))
+HTTP_MAX_KEEPALIVE_PER_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "16"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "60")) # Default read, write and pool timeout
+
+# NULL-prediction sweeper (app.services.ai_sweeper): cases stored with NULL AI predictions carry a top-level ai_retry_at
+# timestamp and are re-inferred in batches of AI_SWEEP_BATCH_CASES, at most one batch every AI_SWEEP_MIN_INTERVAL_SECONDS.
+# After AI_SWEEP_FAILURE_THRESHOLD consecutive failed batches no more are sent; GET /ready on the AI service is probed
+# instead, after AI_SWEEP_PROBE_SECONDS and then with doubling delays up to AI_SWEEP_PROBE_MAX_SECONDS
+AI_SWEEP_ENABLED = os.getenv("AI_SWEEP_ENABLED", "true").lower() == "true"
+AI_SWEEP_BATCH_CASES = int(os.getenv("AI_SWEEP_BATCH_CASES", "8"))
+AI_SWEEP_MIN_INTERVAL_SECONDS = float(os.getenv("AI_SWEEP_MIN_INTERVAL_SECONDS", "30"))
+AI_SWEEP_IDLE_SECONDS = float(os.getenv("AI_SWEEP_IDLE_SECONDS", "300")) # Pause when no case is due
+AI_SWEEP_LEASE_SECONDS = int(os.getenv("AI_SWEEP_LEASE_SECONDS", "600"))
+AI_SWEEP_MAX_ATTEMPTS = int(os.getenv("AI_SWEEP_MAX_ATTEMPTS", "10"))
+AI_SWEEP_FAILURE_THRESHOLD = int(os.getenv("AI_SWEEP_FAILURE_THRESHOLD", "3"))
+AI_SWEEP_PROBE_SECONDS = float(os.getenv("AI_SWEEP_PROBE_SECONDS", "30"))
+AI_SWEEP_PROBE_MAX_SECONDS = float(os.getenv("AI_SWEEP_PROBE_MAX_SECONDS", "600"))
@@ -0,0 +1,91 @@
+import httpx
+from threading import Lock
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from app.core.config import (
+    HTTP2_ENABLED,
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    HTTP_MAX_CONNECTIONS_PER_HOST,
+    HTTP_MAX_KEEPALIVE_PER_HOST,
+    HTTP_TIMEOUT_SECONDS
+)
+
+try:
+    import h2 # noqa: F401 (HTTP/2 support for httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class HttpClients:
+    """
+    Shared keep-alive HTTP clients, one connection pool per origin (scheme, host and port), so the hundreds of
+    calls an export or AI flush makes to the same host reuse TCP+TLS connections instead of handshaking each
+    time. Each origin gets its own connection limits, and HTTP/2 is negotiated where the server and h2 allow it.
+
+    Sync clients are thread-safe and shared by all threads. Async clients belong to the app's event loop.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.Client] = {}
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    @staticmethod
+    def _options() -> dict:
+        return {
+            "http2": HTTP2_ENABLED and HTTP2_AVAILABLE,
+            "limits": httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_HOST,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+            ),
+            "timeout": httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+        }
+
+    def client(self, url: str) -> httpx.Client:
+        """Pooled sync client for url's origin"""
+        origin = self._origin(url)
+        with self._lock:
+            client = self._clients.get(origin)
+            if client is None:
+                client = self._clients[origin] = httpx.Client(**self._options())
+            return client
+
+    def async_client(self, url: str) -> httpx.AsyncClient:
+        """Pooled async client for url's origin; only use it from the app's event loop"""
+        origin = self._origin(url)
+        with self._lock:
+            client = self._async_clients.get(origin)
+            if client is None:
+                client = self._async_clients[origin] = httpx.AsyncClient(**self._options())
+            return client
+
+    def open(self, *urls: str):
+        """Create the pools of hosts known at startup, so the first calls do not pay for client setup"""
+        for url in urls:
+            if url:
+                self.client(url)
+        print(f"[HttpClients] Connection pools ready (HTTP/2 {'on' if HTTP2_ENABLED and HTTP2_AVAILABLE else 'off'}).")
+
+    async def aclose(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+            async_clients, self._async_clients = list(self._async_clients.values()), {}
+        for client in clients:
+            client.close()
+        for async_client in async_clients:
+            await async_client.aclose()
+        print(f"[HttpClients] Closed {len(clients) + len(async_clients)} connection pools.")
+
+def timeout_or_default(timeout: Optional[float]):
+    """httpx treats timeout=None as "no timeout"; map None to the client's configured timeouts instead"""
+    return httpx.USE_CLIENT_DEFAULT if timeout is None else timeout
+
+http_clients = HttpClients()
@@ -1,8 +1,12 @@
 from fastapi import FastAPI, Request
+import time
 
+from app.api.bootstrap import aijobs, aiqueue, sweeper
 from app.api.routes.auth import auth_router
 from app.api.routes.dbmanager import dbmanager_router
 from app.api.routes.invite_codes import invite_router
+from app.core.config import AI_SHUTDOWN_TIMEOUT_SECONDS, AI_URL
+from app.core.http_client import http_clients
 
 app = FastAPI()
 
@@ -10,6 +14,27 @@ app.include_router(auth_router, prefix="/auth")
 app.include_router(dbmanager_router, prefix="/dbmanager")
 app.include_router(invite_router)
 
+@app.on_event("startup")
+def startup():
+    http_clients.open(AI_URL)
+
+@app.on_event("shutdown")
+def shutdown():
+    # Stop claiming and send cases still waiting for a batch within the grace period, then always hand back the
+    # leases of jobs that did not finish so other instances take them over right away
+    deadline = time.monotonic() + AI_SHUTDOWN_TIMEOUT_SECONDS
+    try:
+        sweeper.stop(timeout=0) # Only signal it: a batch in progress is not worth the budget, its claims expire
+        aijobs.stop(timeout=max(0, deadline - time.monotonic()))
+        aiqueue.close(timeout=max(0, deadline - time.monotonic()))
+    finally:
+        aijobs.release_held()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    # Registered after shutdown(), so flushes finishing during shutdown still have their connections
+    await http_clients.aclose()
+
 @app.get("/")
 def read_root(request: Request):
     docs_url = str(request.base_url) + "docs"
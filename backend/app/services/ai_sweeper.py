@@ -0,0 +1,275 @@
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+from threading import Event, Thread
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.api.aiqueue import infer_cases
+from app.api.dbmanager import DbManager
+from app.core.config import (
+    AI_SWEEP_BATCH_CASES,
+    AI_SWEEP_FAILURE_THRESHOLD,
+    AI_SWEEP_IDLE_SECONDS,
+    AI_SWEEP_LEASE_SECONDS,
+    AI_SWEEP_MAX_ATTEMPTS,
+    AI_SWEEP_MIN_INTERVAL_SECONDS,
+    AI_SWEEP_PROBE_MAX_SECONDS,
+    AI_SWEEP_PROBE_SECONDS,
+    AI_URL
+)
+from app.core.firebase import db
+from app.core.http_client import http_clients
+
+class CircuitBreaker:
+    """
+    Tracks whether the AI endpoint is usable.
+
+    Closed: requests flow. After failure_threshold consecutive failures it opens: callers must not send requests,
+    and the endpoint is probed instead (probe_seconds after opening, doubling up to max_probe_seconds while probes
+    keep failing). A successful probe half-opens it: one real request is allowed, and its outcome closes the breaker
+    or opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = AI_SWEEP_FAILURE_THRESHOLD, probe_seconds: float = AI_SWEEP_PROBE_SECONDS, max_probe_seconds: float = AI_SWEEP_PROBE_MAX_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.probe_seconds = probe_seconds
+        self.max_probe_seconds = max_probe_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._probe_delay = probe_seconds
+        self._next_probe_at = 0.0
+
+    def allow_request(self) -> bool:
+        if self.state == "open" and time.monotonic() >= self._next_probe_at:
+            if self._probe():
+                print("[CircuitBreaker] AI endpoint answered the probe, allowing one batch.")
+                self.state = "half_open"
+            else:
+                self._probe_delay = min(self._probe_delay * 2, self.max_probe_seconds)
+                self._next_probe_at = time.monotonic() + self._probe_delay
+        return self.state != "open"
+
+    def seconds_until_probe(self) -> float:
+        """How long until allow_request probes an open breaker again"""
+        return max(0.0, self._next_probe_at - time.monotonic())
+
+    def record_success(self):
+        if self.state != "closed":
+            print("[CircuitBreaker] AI endpoint recovered, closing the circuit.")
+        self.state = "closed"
+        self._failures = 0
+        self._probe_delay = self.probe_seconds
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"[CircuitBreaker] AI endpoint down after {self._failures} failures, opening the circuit.")
+            self.state = "open"
+            self._next_probe_at = time.monotonic() + self._probe_delay
+
+    @staticmethod
+    def _probe() -> bool:
+        # /ready is a cheap readiness check: 200 only once the AI service has a warmed-up model
+        try:
+            return http_clients.client(AI_URL).get(f"{AI_URL}/ready", timeout=5).status_code == 200
+        except Exception:
+            return False
+
+class NullPredictionSweeper:
+    """
+    Re-infers cases that were stored with "NULL" AI predictions because every inference attempt failed.
+
+    Such cases carry a top-level ai_retry_at timestamp (see DbManager.receive_AI_results), so due cases are found
+    with a single-field indexed range query. Each batch of at most batch_cases cases is claimed in a transaction
+    by pushing ai_retry_at lease_seconds ahead, so several backend instances never sweep the same case at once.
+    Batches are sent at most once per min_interval_seconds, and not at all while the circuit breaker reports the
+    AI endpoint down. Results are patched in a transaction that only replaces "NULL" ai_lesion_type values;
+    clinician diagnoses written in the meantime are kept. A case is given up (left NULL, unflagged) after
+    max_attempts claims or when the AI service rejects its images for good.
+    """
+
+    COLLECTION_NAME = "cases"
+
+    def __init__(
+        self,
+        batch_cases: int = AI_SWEEP_BATCH_CASES,
+        min_interval_seconds: float = AI_SWEEP_MIN_INTERVAL_SECONDS,
+        idle_seconds: float = AI_SWEEP_IDLE_SECONDS,
+        lease_seconds: int = AI_SWEEP_LEASE_SECONDS,
+        max_attempts: int = AI_SWEEP_MAX_ATTEMPTS,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.batch_cases = batch_cases
+        self.min_interval_seconds = min_interval_seconds
+        self.idle_seconds = idle_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker()
+        self._stopping = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="ai-null-sweeper", daemon=True)
+        self._thread.start()
+        print(f"[NullPredictionSweeper] Started: up to {self.batch_cases} cases every {self.min_interval_seconds} seconds.")
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stop sweeping, waiting at most timeout seconds for a batch in progress. A batch still running after that is
+        abandoned with the daemon thread; its claims expire after lease_seconds and the cases are swept again.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                swept = self.sweep_once()
+            except Exception as e:
+                print(f"[NullPredictionSweeper] Sweep failed: {e}")
+                swept = 0
+            if swept:
+                wait = self.min_interval_seconds
+            elif self.breaker.state == "open":
+                wait = self.breaker.seconds_until_probe() # Probe on the breaker's schedule, not after a full idle period
+            else:
+                wait = self.idle_seconds
+            self._stopping.wait(wait)
+
+    def sweep_once(self) -> int:
+        """Claim and re-infer one batch of due cases; returns how many cases were claimed"""
+        if not self.breaker.allow_request():
+            return 0
+        cases = self._claim()
+        if not cases:
+            return 0
+
+        fetched: List[Tuple[str, List[bytes]]] = []
+        for case_id, case_data in cases:
+            try:
+                fetched.append((case_id, DbManager.fetch_case_images(case_id, case_data)))
+            except Exception as e:
+                # The lease stays in place: the case is claimed again once it expires
+                print(f"[NullPredictionSweeper] Cannot fetch images of case {case_id}: {e}")
+        if not fetched:
+            return len(cases)
+
+        try:
+            results = infer_cases(fetched)
+        except Exception as e:
+            self.breaker.record_failure()
+            print(f"[NullPredictionSweeper] Inference request failed: {e}")
+            return len(cases)
+
+        retryable_failures = 0
+        for case_id, _ in fetched:
+            result = results.get(case_id, {"status": "error", "error": "missing from response", "retryable": True})
+            if result["status"] == "ok":
+                self._patch(case_id, result["predictions"], result.get("model_version"))
+            elif not result.get("retryable", True):
+                print(f"[NullPredictionSweeper] AI service rejected case {case_id}: {result.get('error')}. Giving up.")
+                self._give_up(case_id)
+            else:
+                retryable_failures += 1
+        if retryable_failures == len(fetched):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        print(f"[NullPredictionSweeper] Re-inferred {len(fetched) - retryable_failures}/{len(cases)} cases.")
+        return len(cases)
+
+    def _claim(self) -> List[Tuple[str, Dict[str, Any]]]:
+        collection = db.collection(self.COLLECTION_NAME)
+        now = datetime.now(timezone.utc)
+        candidates = [doc.reference for doc in collection.where("ai_retry_at", "<=", now).order_by("ai_retry_at").limit(self.batch_cases).stream()]
+        if not candidates:
+            return []
+
+        @firestore.transactional
+        def claim(transaction) -> List[Tuple[str, Dict[str, Any]]]:
+            now = datetime.now(timezone.utc)
+            claimed = []
+            for snapshot in transaction.get_all(candidates):
+                case_data = snapshot.to_dict() if snapshot.exists else None
+                if case_data is None or case_data.get("ai_retry_at") is None or case_data["ai_retry_at"] > now:
+                    continue # Claimed by another instance or already repaired
+                attempts = case_data.get("ai_retry_attempts", 0) + 1
+                if attempts > self.max_attempts:
+                    print(f"[NullPredictionSweeper] Case {snapshot.id} still NULL after {self.max_attempts} attempts. Giving up.")
+                    transaction.update(snapshot.reference, {"ai_retry_at": firestore.DELETE_FIELD})
+                    continue
+                transaction.update(snapshot.reference, {
+                    "ai_retry_at": now + timedelta(seconds=self.lease_seconds),
+                    "ai_retry_attempts": attempts,
+                })
+                claimed.append((snapshot.id, case_data))
+            return claimed
+
+        return claim(db.transaction())
+
+    def _patch(self, case_id: str, predictions: List[str], model_version: Optional[str]):
+        case_ref = db.collection(self.COLLECTION_NAME).document(case_id)
+
+        @firestore.transactional
+        def patch(transaction):
+            snapshot = case_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return
+            diagnoses = snapshot.get("diagnoses")
+            if len(diagnoses) != len(predictions):
+                print(f"[NullPredictionSweeper] Mismatch between diagnosis count and predictions for case {case_id}")
+                return
+            for diagnosis, prediction in zip(diagnoses, predictions):
+                if diagnosis.get("ai_lesion_type", "NULL") == "NULL":
+                    diagnosis["ai_lesion_type"] = prediction
+            transaction.update(case_ref, {
+                "diagnoses": diagnoses,
+                "ai_model_version": model_version,
+                "ai_retry_at": firestore.DELETE_FIELD,
+                "ai_retry_attempts": firestore.DELETE_FIELD,
+            })
+
+        patch(db.transaction())
+
+    def _give_up(self, case_id: str):
+        db.collection(self.COLLECTION_NAME).document(case_id).update({"ai_retry_at": firestore.DELETE_FIELD})
+
+def backfill() -> int:
+    """Flag cases stored with NULL predictions before ai_retry_at existed; returns how many were flagged"""
+    flagged = 0
+    batch = db.batch()
+    for doc in db.collection(NullPredictionSweeper.COLLECTION_NAME).stream():
+        case_data = doc.to_dict()
+        if "ai_retry_at" in case_data:
+            continue
+        if any(diagnosis.get("ai_lesion_type", "NULL") == "NULL" for diagnosis in case_data.get("diagnoses", [])):
+            batch.update(doc.reference, {"ai_retry_at": datetime.now(timezone.utc), "ai_retry_attempts": 0})
+            flagged += 1
+            if flagged % 400 == 0:
+                batch.commit()
+                batch = db.batch()
+    batch.commit()
+    print(f"[NullPredictionSweeper] Flagged {flagged} cases with NULL predictions for re-inference.")
+    return flagged
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Re-infer cases stored with NULL AI predictions")
+    parser.add_argument("--backfill", action="store_true", help="First flag existing NULL cases that are not flagged yet (full collection scan)")
+    parser.add_argument("--batches", type=int, default=1, help="Batches to sweep before exiting")
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill()
+    sweeper = NullPredictionSweeper()
+    for index in range(args.batches):
+        if index > 0:
+            time.sleep(sweeper.min_interval_seconds)
+        if not sweeper.sweep_once():
+            break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import NotFound
+from google.cloud import firestore
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.api.aiqueue import infer_cases
+from app.api.dbmanager import DbManager
+from app.core.firebase import db
+
+class RescoreService:
+    """
+    Resumable bulk re-scoring of historical cases against a given model version.
+
+    Cases are streamed from Firestore in document-id order, one page at a time. Each page is downloaded
+    and decrypted with bounded concurrency, sent to the AI service in large case-keyed batches, and
+    written back to ai_rescores.<model_version> in chunked batch writes. The live ai_lesion_type field is
+    never touched. After every committed page, the last case id is saved to a checkpoint file, so an
+    interrupted run resumes where it stopped.
+    """
+
+    COLLECTION_NAME = "cases"
+    FIRESTORE_BATCH_LIMIT = 500
+
+    def __init__(
+        self,
+        model_version: str,
+        checkpoint_path: Optional[str] = None,
+        page_size: int = 200,
+        download_concurrency: int = 8,
+        inference_batch_cases: int = 16,
+        write_chunk_size: int = 400,
+        request_timeout_seconds: float = 600,
+        force: bool = False
+    ):
+        self.model_version = model_version
+        self.checkpoint_path = checkpoint_path or f"rescore_{model_version}.checkpoint.json"
+        self.page_size = page_size
+        self.download_concurrency = download_concurrency
+        self.inference_batch_cases = inference_batch_cases
+        self.write_chunk_size = min(write_chunk_size, self.FIRESTORE_BATCH_LIMIT)
+        self.request_timeout_seconds = request_timeout_seconds
+        self.force = force
+        # Field path with the version quoted as one segment: versions contain dots
+        self.field_path = firestore.FieldPath("ai_rescores", model_version).to_api_repr()
+        self.state = self._load_checkpoint()
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+            if state.get("model_version") != self.model_version:
+                raise ValueError(f"Checkpoint {self.checkpoint_path} belongs to model version {state.get('model_version')}")
+            print(f"[RescoreService] Resuming after case {state['last_case_id']} ({state['scored']} scored so far)")
+            return state
+        return {"model_version": self.model_version, "last_case_id": None, "scored": 0, "skipped": 0, "failed": 0, "failed_case_ids": []}
+
+    def _save_checkpoint(self):
+        # Write-then-rename so a crash never leaves a truncated checkpoint
+        directory = os.path.dirname(os.path.abspath(self.checkpoint_path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".tmp") as f:
+            json.dump(self.state, f, indent=2)
+            temp_path = f.name
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _pages(self, limit: Optional[int]) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+        collection = db.collection(self.COLLECTION_NAME)
+        seen = 0
+        while limit is None or seen < limit:
+            query = collection.order_by("__name__")
+            if self.state["last_case_id"]:
+                query = query.where("__name__", ">", collection.document(self.state["last_case_id"]))
+            page_size = self.page_size if limit is None else min(self.page_size, limit - seen)
+            page = [(doc.id, doc.to_dict()) for doc in query.limit(page_size).stream()]
+            if not page:
+                return
+            seen += len(page)
+            yield page
+
+    def _fetch(self, case: Tuple[str, Dict[str, Any]]) -> Tuple[str, Optional[List[bytes]], Optional[str]]:
+        case_id, case_data = case
+        try:
+            return case_id, DbManager.fetch_case_images(case_id, case_data, timeout=self.request_timeout_seconds), None
+        except Exception as e:
+            return case_id, None, str(e)
+
+    def _write(self, predictions: Dict[str, List[str]]) -> int:
+        """
+        Write scores in chunked batch writes; returns how many cases were written. A chunk whose batch fails (e.g.
+        one of its cases was deleted mid-run) is retried one document at a time, and cases that still fail are
+        recorded as failed.
+        """
+        items = list(predictions.items())
+        written = 0
+        for start in range(0, len(items), self.write_chunk_size):
+            chunk = items[start:start + self.write_chunk_size]
+            batch = db.batch()
+            for case_id, case_predictions in chunk:
+                batch.update(db.collection(self.COLLECTION_NAME).document(case_id), self._score(case_predictions))
+            try:
+                batch.commit()
+                written += len(chunk)
+                continue
+            except Exception as e:
+                print(f"[RescoreService] Batch write of {len(chunk)} cases failed ({e}), writing them one by one.")
+
+            for case_id, case_predictions in chunk:
+                try:
+                    db.collection(self.COLLECTION_NAME).document(case_id).update(self._score(case_predictions))
+                    written += 1
+                except NotFound:
+                    self._record_failure(case_id, "case deleted during the run")
+                except Exception as e:
+                    self._record_failure(case_id, f"write failed: {e}")
+        return written
+
+    def _score(self, case_predictions: List[str]) -> Dict[str, Any]:
+        return {self.field_path: {"predictions": case_predictions, "scored_at": firestore.SERVER_TIMESTAMP}}
+
+    def _record_failure(self, case_id: str, error: str):
+        print(f"[RescoreService] Case {case_id} failed: {error}")
+        self.state["failed"] += 1
+        self.state["failed_case_ids"].append(case_id)
+
+    def run(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Re-score up to limit cases (all remaining cases if None).
+
+        Returns:
+            The checkpoint state: last_case_id, counts of scored, skipped and failed cases, and failed case ids
+        """
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.download_concurrency) as pool:
+            for page in self._pages(limit):
+                pending = []
+                for case_id, case_data in page:
+                    if not self.force and self.model_version in case_data.get("ai_rescores", {}):
+                        self.state["skipped"] += 1
+                    else:
+                        pending.append((case_id, case_data))
+
+                # Download, decrypt and infer one request's worth of cases at a time to bound memory
+                predictions = {}
+                for start in range(0, len(pending), self.inference_batch_cases):
+                    fetched = []
+                    for case_id, images, error in pool.map(self._fetch, pending[start:start + self.inference_batch_cases]):
+                        if error:
+                            self._record_failure(case_id, error)
+                        else:
+                            fetched.append((case_id, images))
+                    if not fetched:
+                        continue
+
+                    try:
+                        results = infer_cases(fetched, model_version=self.model_version, timeout=self.request_timeout_seconds)
+                    except Exception as e:
+                        for case_id, _ in fetched:
+                            self._record_failure(case_id, f"inference request failed: {e}")
+                        continue
+                    for case_id, _ in fetched:
+                        result = results.get(case_id, {"status": "error", "error": "missing from response"})
+                        if result["status"] == "ok":
+                            predictions[case_id] = result["predictions"]
+                        else:
+                            self._record_failure(case_id, result.get("error"))
+
+                self.state["scored"] += self._write(predictions)
+                self.state["last_case_id"] = page[-1][0]
+                self._save_checkpoint()
+                print(
+                    f"[RescoreService] Through case {self.state['last_case_id']}: {self.state['scored']} scored, "
+                    f"{self.state['skipped']} skipped, {self.state['failed']} failed ({time.time() - started:.0f}s)"
+                )
+
+        return self.state
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Re-score historical cases with a model version loaded on the AI service")
+    parser.add_argument("model_version", help="Checkpoint file name, as listed by the AI service's GET /models")
+    parser.add_argument("--checkpoint", help="Progress file (default: rescore_<model_version>.checkpoint.json)")
+    parser.add_argument("--limit", type=int, help="Stop after this many cases")
+    parser.add_argument("--page-size", type=int, default=200, help="Cases read from Firestore per page")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent blob downloads and decryptions")
+    parser.add_argument("--batch-cases", type=int, default=16, help="Cases per inference request")
+    parser.add_argument("--write-chunk", type=int, default=400, help="Updates per Firestore batch write (max 500)")
+    parser.add_argument("--force", action="store_true", help="Re-score cases that already have a score for this version")
+    args = parser.parse_args()
+
+    service = RescoreService(
+        model_version=args.model_version,
+        checkpoint_path=args.checkpoint,
+        page_size=args.page_size,
+        download_concurrency=args.concurrency,
+        inference_batch_cases=args.batch_cases,
+        write_chunk_size=args.write_chunk,
+        force=args.force
+    )
+    print(json.dumps(service.run(limit=args.limit), indent=2))
+
+if __name__ == "__main__":
+    main()